@@ -1,10 +1,42 @@
-import qrcode
-from PIL import Image
-from argparse import ArgumentParser
-from .img import AnsiImageRenderer, img_to_ansi, resize_image, pad_image, crop_image, composite_background
-from .font import list_fonts, text_to_ansi, colorize_image
-from .comp import combine_ansi_horizontally
+import itertools
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, BooleanOptionalAction
+from importlib import import_module
 from .term import get_terminal_color_depth
+from .output import open_input, stderr, stdout_buffer, write_chunks
+from .cache import cache_enabled
+
+# Public names re-exported lazily so that `ansify comp` and friends only
+# pay for NumPy, PIL and qrcode when a command actually needs them.
+_LAZY_EXPORTS = {
+    "AnsiImageRenderer": ".img",
+    "img_to_ansi": ".img",
+    "iter_ansi_rows": ".img",
+    "resize_image": ".img",
+    "pad_image": ".img",
+    "crop_image": ".img",
+    "composite_background": ".img",
+    "list_fonts": ".font",
+    "text_to_ansi": ".font",
+    "colorize_image": ".font",
+    "combine_ansi_horizontally": ".comp",
+    "iter_combined": ".comp",
+    "parse_ansi": ".grid",
+    "encode_grid": ".grid",
+    "EncodeStats": ".encode",
+    "AnimationPlayer": ".anim",
+    "StreamPlayer": ".stream",
+    "TilePyramid": ".tiles",
+    "load_pyramid": ".tiles",
+}
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
 
 def color_to_color(color: str) -> tuple[int, int, int]:
     """Convert a color string 'R,G,B' to a tuple of integers."""
@@ -35,25 +67,137 @@ def color_to_color(color: str) -> tuple[int, int, int]:
     except ValueError:
         raise ValueError(f"Invalid color format: {color}. Use 'R,G,B' format.")
 
+def parse_box(value: str) -> tuple[int, int, int, int]:
+    """Parse a 'TOP,RIGHT,BOTTOM,LEFT' string into a tuple of integers."""
+    try:
+        top, right, bottom, left = map(int, value.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid box format: {value}. Use 'TOP,RIGHT,BOTTOM,LEFT' format.")
+    return (top, right, bottom, left)
+
+def parse_offset(value: str) -> tuple[int, int]:
+    """Parse an 'X,Y' string into a tuple of integers."""
+    try:
+        x, y = map(int, value.split(","))
+    except ValueError:
+        raise ArgumentTypeError(f"Invalid offset format: {value}. Use 'X,Y' format.")
+    return (x, y)
+
+def _add_render_args(parser):
+    """Image rendering options shared by the img and batch commands."""
+    parser.add_argument("--background", default="255,255,255", help="Background color")
+    parser.add_argument("--brightness", type=float, default=1.0, help="Brightness")
+    parser.add_argument("--width", type=int, default=80, help="Maximum width of the output")
+    parser.add_argument("--height", type=int, default=24, help="Maximum height of the output")
+    parser.add_argument("--padding", type=str, default="0,0,0,0")
+    parser.add_argument("--crop", type=str, default="0,0,0,0")
+    parser.add_argument("--depth", help="Color depth", type=int, default=get_terminal_color_depth())
+    parser.add_argument("--mode", choices=["half", "quadrant", "sextant", "braille"], default="half", help="Cell encoding (pixels per cell: 1x2, 2x2, 2x3, 2x4)")
+    parser.add_argument("--max-bytes", type=int, default=None, help="Fit the output in this many bytes, picking height, depth and color precision (half mode)")
+    parser.add_argument("--dither", choices=["none", "bayer", "blue-noise", "floyd-steinberg", "atkinson"], default="none", help="Dithering for 256, 16 and 2 color output (half mode)")
+
+def _render_options(args) -> dict:
+    """AnsiImageRenderer keyword arguments from parsed render options."""
+    return dict(
+        bg_color=color_to_color(args.background),
+        brightness=args.brightness,
+        max_width=args.width,
+        max_height=args.height,
+        padding=parse_box(args.padding),
+        crop=parse_box(args.crop),
+        depth=args.depth,
+        optimize=args.optimize,
+        mode=args.mode,
+        dither=None if args.dither == "none" else args.dither,
+        max_bytes=args.max_bytes,
+    )
+
+def _iter_qr_rows(text, fg_color, bg_color, depth, optimize, stats):
+    import qrcode
+    from PIL import Image
+    from .img import iter_ansi_rows
+    from .font import colorize_image
+    from .instrument import stage
+    with stage("qr"):
+        qr = qrcode.QRCode(border=0)
+        qr.add_data(text)
+        qr.make()
+        matrix = qr.get_matrix()  # <-- this is the "small" logical QR, not a pixel image
+    size = len(matrix)
+    img = Image.new("RGBA", (size, size))
+
+    for y, row in enumerate(matrix):
+        for x, val in enumerate(row):
+            if val:
+                img.putpixel((x, y), (0, 0, 0, 255))    # Black, fully opaque
+            else:
+                img.putpixel((x, y), (0, 0, 0, 0))      # Transparent (or change color as needed)
+    img = colorize_image(img, fg_color=fg_color, bg_color=bg_color)
+    return iter_ansi_rows(img, depth=depth, optimize=optimize, stats=stats)
+
 # Usage: ansify [GLOBAL] COMMAND [ARGS]
 # Commands:
 #     img IMG_FILE [OPTIONS]  Process an image file
 #         --bg-color R,G,B      Background color (default: 0,0,0)
 #         --brightness VALUE     Brightness adjustment (default: 1.0)
 #     font FONT_FILE [OPTIONS] Process a font file
-def _main():
-    parser = ArgumentParser(description="Render ANSI Graphics")
+class _ArgumentParser(ArgumentParser):
+    """Sends help and errors through output, so a daemon can capture them."""
+    def _print_message(self, message, file=None):
+        if not message:
+            return
+        if file is None or file is sys.stdout:
+            out = stdout_buffer()
+            out.write(message.encode("utf-8"))
+            out.flush()
+        else:
+            stderr().write(message)
+
+def _main(argv=None, commands=None):
+    """Runs the CLI on argv; commands, if given, limits the subcommands allowed."""
+    parser = _ArgumentParser(description="Render ANSI Graphics")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="Emit full SGR sequences for every cell")
+    parser.add_argument("--stats", action="store_true", help="Report output size and bytes saved on stderr")
+    parser.add_argument("--cache", action=BooleanOptionalAction, default=None, help="Use the on-disk render cache (default: ANSIFY_CACHE=1)")
+    parser.add_argument("--cache-dir", default=None, help="Render cache directory")
+    parser.add_argument("--profile", action="store_true", help="Write per-stage timings and counters as JSON to stderr")
+    parser.add_argument("--daemon", action="store_true", help="Render on a running `ansify serve` daemon, falling back to in-process")
+    parser.add_argument("--socket", default=None, help="Daemon socket path (default: ANSIFY_SOCKET or the runtime dir)")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # img command
     img_parser = subparsers.add_parser("img", help="Image commands")
     img_parser.add_argument("file", help="Image file to process")
-    img_parser.add_argument("--background", default="255,255,255", help="Background color")
-    img_parser.add_argument("--brightness", type=float, default=1.0, help="Brightness")
-    img_parser.add_argument("--width", type=int, default=80, help="Maximum width of the output")
-    img_parser.add_argument("--height", type=int, default=24, help="Maximum height of the output")
-    img_parser.add_argument("--padding", type=str, default="0,0,0,0")
-    img_parser.add_argument("--crop", type=str, default="0,0,0,0")
+    _add_render_args(img_parser)
+    img_parser.add_argument("--animate", action="store_true", help="Play animated GIF/APNG/WebP frames in place")
+    img_parser.add_argument("--loop", type=int, default=1, help="Animation loops, 0 for forever")
+
+    # view command
+    view_parser = subparsers.add_parser("view", help="Pan and zoom around a large image")
+    view_parser.add_argument("file", help="Image file to view")
+    view_parser.add_argument("--background", default="255,255,255", help="Background color")
+    view_parser.add_argument("--brightness", type=float, default=1.0, help="Brightness")
+    view_parser.add_argument("--depth", help="Color depth", type=int, default=get_terminal_color_depth())
+    view_parser.add_argument("--rebuild", action="store_true", help="Rebuild the cached tile pyramid")
+
+    # stream command
+    stream_parser = subparsers.add_parser("stream", help="Play raw video frames live")
+    stream_parser.add_argument("file", nargs="?", default="-", help="Raw frame source (default: stdin)")
+    stream_parser.add_argument("--size", required=True, help="Frame size as WIDTHxHEIGHT")
+    stream_parser.add_argument("--format", choices=["rgb24", "rgba"], default="rgb24", help="Pixel format of the frames")
+    stream_parser.add_argument("--fps", type=float, default=30.0, help="Target frame rate, 0 to show every frame as it arrives")
+    stream_parser.add_argument("--height", type=int, default=24, help="Maximum height of the output")
+    stream_parser.add_argument("--background", default="255,255,255", help="Background color for rgba frames")
+    stream_parser.add_argument("--brightness", type=float, default=1.0, help="Brightness")
+    stream_parser.add_argument("--depth", help="Color depth", type=int, default=get_terminal_color_depth())
+
+    # batch command
+    batch_parser = subparsers.add_parser("batch", help="Render many images in parallel")
+    batch_parser.add_argument("inputs", nargs="*", help="Image files or glob patterns")
+    batch_parser.add_argument("--manifest", help="File listing one image path per line")
+    batch_parser.add_argument("--out-dir", default=".", help="Directory for the rendered .ans files")
+    batch_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    _add_render_args(batch_parser)
 
     # text command
     text_parser = subparsers.add_parser("text", help="Text commands")
@@ -67,91 +211,237 @@ def _main():
     # comp command
     comp_parser = subparsers.add_parser("comp", help="Compositing commands")
     comp_parser.add_argument("files", nargs='+', help="Image files to process")
+    comp_parser.add_argument("--layout", choices=["horizontal", "vertical", "grid", "overlay"], default="horizontal", help="How to arrange the inputs")
+    comp_parser.add_argument("--columns", type=int, default=2, help="Inputs per row for --layout grid")
+    comp_parser.add_argument("--gap", type=int, default=0, help="Blank cells between inputs")
+    comp_parser.add_argument("--at", type=parse_offset, action="append", default=[], help="X,Y cell offset of each overlaid input after the first")
+    comp_parser.add_argument("--depth", type=int, default=None, help="Re-quantize colors to this depth")
 
     # Qr Code command
     qr_parser = subparsers.add_parser("qr", help="QR Code commands")
     qr_parser.add_argument("text", help="Text to encode in QR Code")
     qr_parser.add_argument("--color", default="255,255,255", help="Foreground color (R,G,B)")
     qr_parser.add_argument("--background", default="0,0,0", help="Background color (R,G,B)")
+    qr_parser.add_argument("--depth", help="Color depth", type=int, default=get_terminal_color_depth())
+
+    # serve command
+    serve_parser = subparsers.add_parser("serve", help="Run a render daemon for --daemon clients")
+    serve_parser.add_argument("--workers", type=int, default=None, help="Render threads (default: CPU count)")
+
+    # cache command
+    cache_parser = subparsers.add_parser("cache", help="Render cache commands")
+    cache_parser.add_argument("action", choices=["stats", "clear"], help="Show cache statistics or empty the cache")
+
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    if commands is not None and args.command not in commands:
+        parser.error(f"{args.command} cannot run on the daemon")
+    if commands is not None and getattr(args, "animate", False):
+        parser.error("--animate cannot run on the daemon")
+    if getattr(args, "dither", "none") != "none" and args.mode != "half":
+        parser.error("--dither only supports --mode half")
+    if getattr(args, "max_bytes", None) is not None and args.mode != "half":
+        parser.error("--max-bytes only supports --mode half")
+    if args.daemon and not getattr(args, "animate", False):
+        from .daemon import DAEMON_COMMANDS, forward
+        if args.command in DAEMON_COMMANDS:
+            # The daemon has its own terminal: pin the depth we detected here
+            forwarded = [a for a in argv if a != "--daemon"]
+            if getattr(args, "depth", None) is not None:
+                forwarded += ["--depth", str(args.depth)]
+            files = [args.file] if args.command == "img" else getattr(args, "files", [])
+            status = forward(forwarded, files, path=args.socket)
+            if status is not None:
+                return status
+    if not args.profile:
+        return _run(parser, args)
+    import json
+    from .instrument import profiling
+    with profiling() as profile:
+        try:
+            return _run(parser, args)
+        finally:
+            report = {"command": args.command, **profile.report()}
+            print(json.dumps(report, indent=2), file=stderr())
 
-    args = parser.parse_args()
+def _run(parser, args):
+    stats = None
+    if args.stats:
+        from .encode import EncodeStats
+        stats = EncodeStats()
+    cache = None
+    if args.command == "cache" or cache_enabled(args.cache):
+        from .cache import RenderCache
+        cache = RenderCache(args.cache_dir)
     if args.command == "img":
-        bg_color_tuple = color_to_color(args.background)
-        renderer = AnsiImageRenderer(
-            bg_color=bg_color_tuple,
-            brightness=args.brightness,
-            max_width=args.width,
-            max_height=args.height
-        )
-        img = Image.open(args.file)
-        img = composite_background(img, bg_color=bg_color_tuple)
-        img = resize_image(img, args.height)
-        img = crop_image(
-            img,
-            crop_top=int(args.crop.split(",")[0]),
-            crop_right=int(args.crop.split(",")[1]),
-            crop_bottom=int(args.crop.split(",")[2]),
-            crop_left=int(args.crop.split(",")[3])
-        )
-        img = pad_image(
-            img,
-            pad_top=int(args.padding.split(",")[0]),
-            pad_right=int(args.padding.split(",")[1]),
-            pad_bottom=int(args.padding.split(",")[2]),
-            pad_left=int(args.padding.split(",")[3]),
-            bg_color=bg_color_tuple
-        )
-        ansi_art = img_to_ansi(img, bg_color=bg_color_tuple, brightness=args.brightness)
-        print("\n".join(ansi_art))
+        from PIL import Image
+        from .img import AnsiImageRenderer
+        renderer = AnsiImageRenderer(**_render_options(args), cache=cache)
+        if args.animate:
+            with open_input(args.file) as source:
+                img = Image.open(source)
+                if getattr(img, "is_animated", False):
+                    if args.mode != "half":
+                        parser.error("--animate only supports --mode half")
+                    from .anim import AnimationPlayer
+                    anim_stats = AnimationPlayer(renderer).play(img, loops=args.loop)
+                    if args.stats:
+                        print(f"ansify: {anim_stats}", file=stderr())
+                    return 0
+        with open_input(args.file) as source:
+            written = write_chunks(renderer.iter_file(source, stats=stats))
+        if args.stats and renderer.budget_choice is not None:
+            print(f"ansify: {renderer.budget_choice}", file=stderr())
+        if args.max_bytes is not None and written > args.max_bytes:
+            print(f"ansify: warning: output is {written} bytes, over --max-bytes {args.max_bytes} even at the smallest settings", file=stderr())
+    elif args.command == "view":
+        if not sys.stdin.isatty():
+            parser.error("view needs an interactive terminal")
+        from .tiles import build_pyramid, load_pyramid, pyramid_dir
+        from .view import Viewer
+        print("ansify: loading tiles...", file=stderr())
+        if args.rebuild:
+            pyramid = build_pyramid(args.file, pyramid_dir(args.file))
+        else:
+            pyramid = load_pyramid(args.file)
+        Viewer(pyramid, bg_color=color_to_color(args.background), brightness=args.brightness, depth=args.depth).run()
+        return 0
+    elif args.command == "stream":
+        from .anim import AnimationStats
+        from .stream import FRAME_FORMATS, FrameReader, StreamPlayer
+        try:
+            width, height = map(int, args.size.lower().split("x"))
+        except ValueError:
+            parser.error(f"Invalid frame size: {args.size}. Use WIDTHxHEIGHT.")
+        if width <= 0 or height <= 0:
+            parser.error(f"Invalid frame size: {args.size}. Width and height must be positive.")
+        if args.file == "-":
+            source = open(sys.stdin.fileno(), "rb", buffering=0, closefd=False)
+        else:
+            source = open(args.file, "rb", buffering=0)
+        stream_stats = AnimationStats()
+        with source:
+            reader = FrameReader(source, width, height, FRAME_FORMATS[args.format])
+            player = StreamPlayer(
+                reader, args.height, args.depth, fps=args.fps,
+                bg_color=color_to_color(args.background), brightness=args.brightness,
+            )
+            try:
+                player.play(stats=stream_stats)
+            except KeyboardInterrupt:
+                pass
+        print(f"ansify: {stream_stats}", file=stderr())
+        return 0
+    elif args.command == "batch":
+        from .batch import collect_inputs, print_error, render_batch
+        inputs = collect_inputs(args.inputs, manifest=args.manifest)
+        try:
+            result = render_batch(inputs, args.out_dir, workers=args.workers, on_error=print_error, cache=cache, **_render_options(args))
+        except ValueError as e:
+            print(f"ansify: {e}", file=stderr())
+            return 1
+        print(f"ansify: {result}", file=stderr())
+        return 1 if result.failed else 0
     elif args.command == "qr":
         fg_color_tuple = color_to_color(args.color)
         bg_color_tuple = color_to_color(args.background)
-        qr = qrcode.QRCode(border=0)
-        qr.add_data(args.text)
-        qr.make()
-        matrix = qr.get_matrix()  # <-- this is the "small" logical QR, not a pixel image
-        size = len(matrix)
-        img = Image.new("RGBA", (size, size))
-
-        for y, row in enumerate(matrix):
-            for x, val in enumerate(row):
-                if val:
-                    img.putpixel((x, y), (0, 0, 0, 255))    # Black, fully opaque
-                else:
-                    img.putpixel((x, y), (0, 0, 0, 0))      # Transparent (or change color as needed)
-        img = colorize_image(img, fg_color=fg_color_tuple, bg_color=bg_color_tuple)
-        print("\n".join(img_to_ansi(img)))
+        rows = lambda: _iter_qr_rows(args.text, fg_color_tuple, bg_color_tuple, args.depth, args.optimize, stats)
+        if cache is not None:
+            key = cache.key(
+                "qr", args.text.encode("utf-8"), color=fg_color_tuple, background=bg_color_tuple,
+                depth=args.depth, optimize=args.optimize,
+            )
+            hit = cache.get(key)
+            if hit is not None and stats is not None:
+                stats.add_cached(hit)
+            write_chunks([hit] if hit is not None else cache.tee(key, rows()))
+        else:
+            write_chunks(rows())
     elif args.command == "text":
+        from .font import text_to_ansi
         text = args.text
         font_color_tuple = args.color
         bg_color_tuple = args.background
-        for line in text.splitlines():
-            print(
-                text_to_ansi(
-                    line,
-                    font=args.font,
-                    size=args.font_size,
-                    background=color_to_color(bg_color_tuple),
-                    foreground=color_to_color(font_color_tuple)
-                ), end="")
-        print("\x1b[0m")  # Reset ANSI colors at the end
+        rendered = (
+            text_to_ansi(
+                line,
+                font=args.font,
+                size=args.font_size,
+                background=color_to_color(bg_color_tuple),
+                foreground=color_to_color(font_color_tuple),
+                depth=args.depth,
+                optimize=args.optimize,
+                stats=stats,
+                cache=cache
+            ).encode("utf-8")
+            for line in text.splitlines()
+        )
+        write_chunks(itertools.chain(rendered, [b"\x1b[0m\n"]))  # Reset ANSI colors at the end
         # Here you would add the logic to process the font file
     elif args.command == "comp":
         # Assume args.files are stdout to ANSI streams, NOT IMAGES
-        # We compoite EACH stream horizontally
-        streams = [open(f).read() for f in args.files]
-        print(combine_ansi_horizontally(*streams))
+        from .instrument import stage, timed_iter
+        if args.layout == "horizontal" and not args.gap and args.depth is None:
+            from .comp import iter_combined
+            # We composite EACH stream horizontally, a line at a time, so that
+            # <(ansify ...) pipes are drawn as soon as every panel has a line
+            streams = [open_input(f, text=True) for f in args.files]
+            try:
+                combined = timed_iter("comp", iter_combined(*streams))
+                lines = ((line + "\n").encode("utf-8") for line in combined)
+                write_chunks(lines, chunk_size=1)
+            finally:
+                for stream in streams:
+                    stream.close()
+        else:
+            from . import grid
+            grids = []
+            for f in args.files:
+                with open_input(f, text=True) as stream:
+                    text = stream.read()
+                with stage("parse"):
+                    grids.append(grid.parse_ansi(text))
+            with stage("layout"):
+                if args.layout == "horizontal":
+                    out = grid.hstack(grids, gap=args.gap)
+                elif args.layout == "vertical":
+                    out = grid.vstack(grids, gap=args.gap)
+                elif args.layout == "grid":
+                    out = grid.grid_layout(grids, args.columns, gap=args.gap)
+                else:
+                    out = grids[0]
+                    for i, top in enumerate(grids[1:]):
+                        x, y = args.at[i] if i < len(args.at) else (0, 0)
+                        out = grid.overlay(out, top, x, y)
+                if args.depth is not None:
+                    out = grid.requantize(out, args.depth)
+            with stage("encode"):
+                data = ("\n".join(grid.encode_grid(out)) + "\n").encode("utf-8")
+            write_chunks([data])
+    elif args.command == "serve":
+        from .daemon import serve
+        serve(args.socket, workers=args.workers)
+        return 0
+    elif args.command == "cache":
+        if args.action == "clear":
+            cache.clear()
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
+        return 0
     else:
         print("Unknown command")
         return 1
+    if stats is not None:
+        print(f"ansify: {stats}", file=stderr())
+        if cache is not None:
+            print(f"ansify: cache {cache.hits} hits, {cache.misses} misses", file=stderr())
     return 0
 
-import sys
-
 def main():
     # try:
     #     return _main()
     # except Exception as e:
     #     print(f"Error: {e}", file=sys.stderr)
     #     return 1
-    _main()
+    return _main()
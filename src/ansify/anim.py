@@ -0,0 +1,100 @@
+import time
+
+from PIL import Image, ImageSequence
+
+from .encode import encode_damage, encode_halfblock
+from .img import AnsiImageRenderer, resolve_depth
+from .output import stdout_buffer
+
+# Frame delay used when a frame carries no duration (milliseconds)
+DEFAULT_FRAME_MS = 100
+
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+class AnimationStats:
+    """Playback counters reported once an animation finishes."""
+    def __init__(self):
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.bytes_out = 0
+        self.elapsed = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frames_shown / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_frame(self) -> float:
+        return self.bytes_out / self.frames_shown if self.frames_shown else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.frames_shown} frames, {self.frames_dropped} dropped, "
+            f"{self.fps:.1f} fps, {self.bytes_per_frame:.0f} bytes/frame"
+        )
+
+def iter_frames(img: Image.Image):
+    """Lazily yields (frame, duration in seconds) for every frame of img."""
+    for frame in ImageSequence.Iterator(img):
+        duration = frame.info.get("duration") or DEFAULT_FRAME_MS
+        yield frame.convert("RGBA"), duration / 1000
+
+class AnimationPlayer:
+    """
+    Plays animated images in place using an AnsiImageRenderer.
+    The first frame is drawn in full; later frames only redraw the cells
+    that changed since the last emitted frame. Frames whose display slot
+    has already passed are dropped instead of encoded.
+    """
+    def __init__(self, renderer: AnsiImageRenderer, out=None, clock=time.monotonic, sleep=time.sleep):
+        self.renderer = renderer
+        self.depth = resolve_depth(renderer.depth)
+        self.out = out
+        self.clock = clock
+        self.sleep = sleep
+
+    def play(self, img: Image.Image, loops=1, stats=None) -> AnimationStats:
+        """
+        Plays img loops times (0 loops forever).
+        Returns the AnimationStats for the run.
+        """
+        out = self.out or stdout_buffer()
+        if stats is None:
+            stats = AnimationStats()
+        prev = None
+        start = self.clock()
+        due = start
+        loop = 0
+        out.write(HIDE_CURSOR.encode())
+        try:
+            while loops == 0 or loop < loops:
+                for frame, duration in iter_frames(img):
+                    due += duration
+                    if prev is not None and self.clock() >= due:
+                        stats.frames_dropped += 1
+                        continue
+                    prev, data = self._encode_frame(frame, prev)
+                    out.write(data)
+                    out.flush()
+                    stats.frames_shown += 1
+                    stats.bytes_out += len(data)
+                    delay = due - self.clock()
+                    if delay > 0:
+                        self.sleep(delay)
+                loop += 1
+        finally:
+            out.write(SHOW_CURSOR.encode())
+            out.flush()
+            stats.elapsed = self.clock() - start
+        return stats
+
+    def _encode_frame(self, frame, prev):
+        depth = self.depth
+        top, bottom = cells = self.renderer.cells(frame)
+        if prev is None or prev[0].shape != top.shape:
+            lines = encode_halfblock(top, bottom, depth, optimize=True)
+            data = "".join(line + "\n" for line in lines)
+        else:
+            data = encode_damage(prev[0], prev[1], top, bottom, depth)
+        return cells, data.encode("utf-8")
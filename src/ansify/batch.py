@@ -0,0 +1,136 @@
+import collections
+import glob
+import itertools
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+class BatchResult:
+    """Outcome of a batch render: per-item failures plus throughput."""
+    def __init__(self):
+        self.rendered = []
+        self.failed = []
+        self.elapsed = 0.0
+
+    @property
+    def images_per_sec(self) -> float:
+        total = len(self.rendered) + len(self.failed)
+        return total / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{len(self.rendered)} rendered, {len(self.failed)} failed "
+            f"in {self.elapsed:.2f}s ({self.images_per_sec:.1f} images/sec)"
+        )
+
+def collect_inputs(patterns=(), manifest=None) -> list[str]:
+    """
+    Expands glob patterns and reads a manifest (one path per line, blank
+    lines and '#' comments ignored) into a de-duplicated list of paths.
+    """
+    paths = []
+    if manifest is not None:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.append(line)
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        paths += matches if matches else [pattern]
+    return list(dict.fromkeys(paths))
+
+def output_paths(inputs, out_dir, ext=".ans") -> list[str]:
+    """
+    Mirrors inputs under out_dir relative to their common directory.
+    Inputs that differ only by extension keep it (a.png.ans, a.jpg.ans)
+    so that no two share an output.
+    """
+    if not inputs:
+        return []
+    dirs = [os.path.dirname(os.path.abspath(p)) for p in inputs]
+    root = os.path.commonpath(dirs)
+    rel = [os.path.relpath(os.path.abspath(p), root) for p in inputs]
+    stems = [os.path.splitext(r)[0] for r in rel]
+    clashes = collections.Counter(os.path.normcase(s) for s in stems)
+    outputs = [
+        os.path.join(out_dir, (r if clashes[os.path.normcase(s)] > 1 else s) + ext)
+        for r, s in zip(rel, stems)
+    ]
+    seen = {}
+    for path, out in zip(inputs, outputs):
+        other = seen.setdefault(os.path.normcase(out), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both be written to {out}")
+    return outputs
+
+def render_file(path, out_path, options) -> int:
+    """
+    Renders one image file to out_path; returns the bytes written. The
+    output is written to a temp file first and moved into place once
+    complete, so a failed render never leaves a truncated file behind.
+    """
+    from .img import AnsiImageRenderer
+    from .output import write_chunks
+    rows = AnsiImageRenderer(**options).iter_file(path)
+    first = next(rows, b"")  # Fail before creating the output file
+    directory = os.path.dirname(out_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Not mkstemp: its 0600 mode would stick to the finished file
+    tmp = os.path.join(directory, f".tmp-{os.getpid()}-{os.path.basename(out_path)}")
+    try:
+        with open(tmp, "wb") as out:
+            written = write_chunks(itertools.chain([first], rows), out)
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return written
+
+def _render_job(job):
+    path, out_path, options = job
+    try:
+        render_file(path, out_path, options)
+    except Exception as e:
+        return path, out_path, f"{type(e).__name__}: {e}"
+    return path, out_path, None
+
+def render_batch(inputs, out_dir, workers=None, ext=".ans", on_error=None, **options) -> BatchResult:
+    """
+    Renders every input image to its own file under out_dir.
+    options are passed to AnsiImageRenderer (max_width, max_height,
+    bg_color, brightness, padding, crop, depth, optimize, cache). Work is
+    spread over a pool of `workers` processes (default: CPU count; 1
+    renders in-process). A failing item is recorded in result.failed and passed to
+    on_error(path, message) instead of aborting the batch.
+    """
+    result = BatchResult()
+    jobs = [(p, o, options) for p, o in zip(inputs, output_paths(inputs, out_dir, ext))]
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1 or len(jobs) <= 1:
+        outcomes = map(_render_job, jobs)
+        _collect(outcomes, result, on_error)
+    else:
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            _collect(pool.map(_render_job, jobs, chunksize=chunksize), result, on_error)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def _collect(outcomes, result, on_error):
+    for path, out_path, error in outcomes:
+        if error is None:
+            result.rendered.append(out_path)
+        else:
+            result.failed.append((path, error))
+            if on_error is not None:
+                on_error(path, error)
+
+def print_error(path, message):
+    print(f"ansify: {path}: {message}", file=sys.stderr)
@@ -0,0 +1,256 @@
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+# Inputs are generated from a fixed seed so every run measures the same work
+BENCH_SEED = 1234
+DEFAULT_REPEAT = 5
+# Allowed slowdown (or memory growth) over the baseline before failing
+DEFAULT_TOLERANCE = 0.25
+# Ships with matplotlib, so the font index finds it without system fonts
+BENCH_FONT = "DejaVu Sans"
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Registers a setup function returning the callable to time."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def gradient(w, h):
+    from PIL import Image
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    rgb = np.stack(np.broadcast_arrays(x + 0 * y, y + 0 * x, (x + y) / 2), axis=-1)
+    return Image.fromarray(rgb.astype(np.uint8), "RGB")
+
+def noise(w, h):
+    from PIL import Image
+    rng = np.random.default_rng(BENCH_SEED)
+    return Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), "RGB")
+
+def alpha_heavy(w, h):
+    """Noise whose alpha sweeps from transparent to opaque in bands."""
+    from PIL import Image
+    rng = np.random.default_rng(BENCH_SEED + 1)
+    rgba = rng.integers(0, 256, (h, w, 4), dtype=np.uint8)
+    rgba[..., 3] = (np.arange(w) * 7 % 256).astype(np.uint8)
+    return Image.fromarray(rgba, "RGBA")
+
+def long_text(n=160):
+    words = "the quick brown fox jumps over the lazy dog 0123456789".split()
+    out = []
+    while len(" ".join(out)) < n:
+        out.append(words[len(out) % len(words)])
+    return " ".join(out)[:n]
+
+for _name, _make in (("gradient", gradient), ("noise", noise), ("alpha", alpha_heavy)):
+    for _depth in (8, 24):
+        def _setup(make=_make, depth=_depth):
+            from .img import img_to_ansi
+            img = make(160, 96)
+            return lambda: img_to_ansi(img, depth=depth)
+        benchmark(f"img_to_ansi/{_name}/{_depth}")(_setup)
+
+# 200x100 cells at 256 colors, plain and with each dither method
+for _dither in (None, "bayer", "blue-noise", "floyd-steinberg", "atkinson"):
+    def _setup(dither=_dither):
+        from .img import img_to_ansi
+        img = gradient(200, 200)
+        return lambda: img_to_ansi(img, depth=8, dither=dither)
+    benchmark(f"dither/{_dither or 'none'}/8")(_setup)
+
+@benchmark("img_to_ansi/tall/24")
+def _tall():
+    from .img import img_to_ansi
+    img = gradient(24, 2400)
+    return lambda: img_to_ansi(img, depth=24)
+
+@benchmark("composite_background/alpha")
+def _composite():
+    from .img import composite_background
+    img = alpha_heavy(640, 480)
+    return lambda: composite_background(img, (255, 255, 255))
+
+@benchmark("resize_image/noise")
+def _resize():
+    from .img import resize_image
+    img = noise(1280, 720)
+    return lambda: resize_image(img, 48)
+
+@benchmark("prepare/alpha_large")
+def _prepare():
+    from .img import AnsiImageRenderer
+    img = alpha_heavy(1920, 1280)
+    renderer = AnsiImageRenderer(80, 24, (255, 255, 255), 1.0, crop=(1, 1, 1, 1), padding=(1, 0, 1, 0))
+    return lambda: renderer.prepare(img)
+
+@benchmark("budget/gradient/4k")
+def _budget():
+    from .img import AnsiImageRenderer
+    img = gradient(640, 480)
+    renderer = AnsiImageRenderer(80, 48, (0, 0, 0), 1.0, depth=24, max_bytes=4096)
+    return lambda: renderer.render(img)
+
+@benchmark("text_to_ansi/long")
+def _text():
+    from .font import text_to_ansi
+    line = long_text()
+    return lambda: text_to_ansi(line, BENCH_FONT, 16, (0, 0, 0), (255, 255, 255), depth=24)
+
+def _layers(n):
+    from .layer import BackgroundLayer, ImageLayer, Rotate
+    layers = [BackgroundLayer((255, 255, 255, 255))]
+    for i in range(n - 1):
+        layer = ImageLayer(alpha_heavy(64, 64))
+        layer.set_transform(Rotate(i * 0.3))
+        layers.append(layer)
+    return layers
+
+for _n in (4, 16):
+    def _setup(n=_n):
+        from .layer import Compositor
+        layers = _layers(n)
+        return lambda: Compositor(160, 96, layers).render()
+    benchmark(f"compositor/{_n}_layers")(_setup)
+
+@benchmark("compositor/16_layers_incremental")
+def _incremental():
+    from .layer import Compositor, Rotate
+    layers = _layers(16)
+    comp = Compositor(160, 96, layers)
+    comp.render()
+    angle = [0.0]
+    def run():
+        angle[0] += 0.1
+        layers[8].set_transform(Rotate(angle[0]))
+        return comp.render()
+    return run
+
+@benchmark("compositor/large_image")
+def _large_image():
+    from .layer import BackgroundLayer, Compositor, ImageLayer, Rotate
+    layer = ImageLayer(noise(4000, 3000))
+    layer.set_transform(Rotate(0.3))
+    layers = [BackgroundLayer((255, 255, 255, 255)), layer]
+    return lambda: Compositor(160, 96, layers).render()
+
+@benchmark("combine_ansi_horizontally/3")
+def _combine():
+    from .comp import combine_ansi_horizontally
+    from .img import img_to_ansi
+    panels = ["\n".join(img_to_ansi(make(80, 96), depth=24)) for make in (gradient, noise, alpha_heavy)]
+    return lambda: combine_ansi_horizontally(*panels)
+
+@benchmark("grid/parse")
+def _parse():
+    from .grid import parse_ansi
+    from .img import img_to_ansi
+    # About 4 MB of 24-bit output, one SGR per cell
+    ansi = "\n".join(img_to_ansi(noise(400, 576), depth=24))
+    return lambda: parse_ansi(ansi)
+
+def _bytes_per_cell(output):
+    """Output bytes per visible terminal cell, or None for non-text output."""
+    from .comp import visible_width
+    if isinstance(output, str):
+        output = output.splitlines()
+    if not isinstance(output, list) or not all(isinstance(line, str) for line in output):
+        return None
+    cells = sum(visible_width(line) for line in output)
+    size = sum(len(line.encode("utf-8")) for line in output)
+    return size / cells if cells else None
+
+def measure(run, repeat=DEFAULT_REPEAT) -> dict:
+    """
+    Median wall time over repeat runs, peak memory of one more run as
+    traced by tracemalloc (Python and NumPy allocations, not PIL's), and
+    output bytes per cell.
+    """
+    output = run()  # Warm caches and lazy imports
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times),
+        "peak_bytes": peak,
+        "bytes_per_cell": _bytes_per_cell(output),
+    }
+
+def run_benchmarks(names=None, repeat=DEFAULT_REPEAT, on_result=None) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = measure(setup(), repeat=repeat)
+        if on_result is not None:
+            on_result(name, results[name])
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Regressions of results against a baseline: time or peak memory more
+    than tolerance above it, or any growth in output bytes per cell.
+    """
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for field in ("seconds", "peak_bytes"):
+            if result[field] > base[field] * (1 + tolerance):
+                problems.append(f"{name}: {field} {result[field]:.6g} > baseline {base[field]:.6g}")
+        old, new = base.get("bytes_per_cell"), result["bytes_per_cell"]
+        if old is not None and new is not None and new > old + 1e-9:
+            problems.append(f"{name}: bytes_per_cell {new:.3f} > baseline {old:.3f}")
+    return problems
+
+def _print_result(name, result):
+    density = result["bytes_per_cell"]
+    density = f"{density:8.2f}" if density is not None else f"{'-':>8}"
+    print(
+        f"{name:40} {result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024:10.0f} KiB {density} B/cell",
+        flush=True,
+    )
+
+def main(argv=None):
+    parser = ArgumentParser(description="Benchmark ansify's rendering paths")
+    parser.add_argument("names", nargs="*", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed regression as a fraction")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, repeat=args.repeat, on_result=_print_result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"regression: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
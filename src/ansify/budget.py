@@ -0,0 +1,141 @@
+import numpy as np
+
+from PIL import Image
+
+from .encode import EncodeStats, _params_len, _run_boundaries, encode_halfblock, image_to_cells
+from .instrument import count, stage
+
+# Fractions of the requested height tried, largest first
+BUDGET_SCALES = (1.0, 0.85, 0.7, 0.55, 0.4, 0.3, 0.2, 0.1)
+
+# (depth, bits kept per channel), best first. Fewer bits make neighbouring
+# cells share colors, so runs get longer and SGR sequences shorter.
+COLOR_LADDER = ((24, 8), (24, 6), (24, 5), (24, 4), (8, 8))
+# Tried only when nothing above fits at any scale: 16 colors and
+# monochrome lose more than a smaller image does
+LOW_COLOR_LADDER = ((4, 8), (1, 8))
+
+# Forward-filling rounds estimate_size runs before encoding the lines
+# that have not settled
+ESTIMATE_ROUNDS = 4
+
+class BudgetChoice:
+    """The encoding settings picked to fit a byte budget."""
+    def __init__(self, height, depth, bits, estimate):
+        self.height = height
+        self.depth = depth
+        self.bits = bits
+        self.estimate = estimate
+        self.size = None
+
+    def __str__(self):
+        precision = f" at {self.bits} bits/channel" if self.depth == 24 and self.bits < 8 else ""
+        size = self.size if self.size is not None else self.estimate
+        return f"budget: height {self.height}, {self.depth}-bit{precision}, {size} bytes"
+
+def _before(values, setters, idx, row_start):
+    """For each run, values at the last earlier setter run on its line, else -1."""
+    last = np.maximum.accumulate(np.where(setters, idx, -1))
+    prev = np.concatenate(([-1], last[:-1]))
+    return np.where(prev >= row_start, values[prev], -1)
+
+def estimate_size(top: np.ndarray, bottom: np.ndarray, depth: int) -> int:
+    """
+    Bytes encode_halfblock(optimize=True) emits for these cells, newlines
+    included, computed with whole-array operations on the runs of
+    identical cells. The encoder's fg/bg state and half-block flips depend
+    on the runs before them, so they are settled by rounds of
+    forward-filling: each round fixes at least one more run per line.
+    Lines still changing after ESTIMATE_ROUNDS, such as long chains of
+    flips in smooth gradients, are measured by encoding them.
+    """
+    rows, w = top.shape
+    if depth == 1:
+        return int(np.where(((top << 1) | bottom) == 0, 1, 3).sum()) + rows
+    ry, rx = np.nonzero(_run_boundaries(top, bottom)[:, :-1])
+    pos = ry * w + rx
+    lengths = np.diff(pos, append=rows * w)
+    t, b = top[ry, rx], bottom[ry, rx]
+    split = t != b
+    idx = np.arange(len(pos))
+    row_start = np.maximum.accumulate(np.where(rx == 0, idx, 0))
+    fg, bg = t, b  # Colors each split run is drawn with, after any flip
+    full = np.zeros_like(split)
+    for _ in range(ESTIMATE_ROUNDS):
+        cur_fg = _before(fg, split, idx, row_start)
+        cur_bg = _before(np.where(split, bg, t), ~full, idx, row_start)
+        flip = split & ((cur_fg != t).astype(int) + (cur_bg != b) > (cur_fg != b).astype(int) + (cur_bg != t))
+        new_fg, new_bg = np.where(flip, b, t), np.where(flip, t, b)
+        # Solid runs in the current fg are drawn as full blocks
+        new_full = ~split & (cur_fg == t) & (cur_bg != t)
+        changed = (new_fg != fg) | (new_full != full)
+        fg, bg, full = new_fg, new_bg, new_full
+        if not changed.any():
+            break
+    fg_emit = split & (cur_fg != fg)
+    bg_emit = np.where(split, cur_bg != bg, ~full & (cur_bg != t))
+    sgr = np.where(fg_emit | bg_emit, 3 + (fg_emit & bg_emit), 0)
+    sgr += np.where(fg_emit, _params_len(fg, depth, False), 0)
+    sgr += np.where(bg_emit, _params_len(bg, depth, True), 0)
+    glyph = np.where(split | full, 3, 1)
+    line_sizes = np.bincount(ry, weights=sgr + glyph * lengths, minlength=rows) + 5  # RESET + newline
+    # A line that did not change in the last round has settled
+    unsettled = np.unique(ry[changed])
+    if len(unsettled):
+        count("budget_lines_encoded", len(unsettled))
+        lines = encode_halfblock(top[unsettled], bottom[unsettled], depth, optimize=True)
+        line_sizes[unsettled] = [len(line.encode("utf-8")) + 1 for line in lines]
+    return int(line_sizes.sum())
+
+def reduce_precision(img: Image.Image, bits: int) -> Image.Image:
+    """img with each channel rounded to the nearest of 2**bits levels."""
+    if bits >= 8:
+        return img
+    step = 1 << (8 - bits)
+    arr = np.asarray(img, dtype=np.int32)
+    arr = np.minimum((arr + step // 2) // step * step, 255)
+    return Image.fromarray(arr.astype(np.uint8), img.mode)
+
+def candidates(max_height, max_depth):
+    """(height, depth, bits) settings in decreasing order of quality."""
+    heights = list(dict.fromkeys(max(1, int(max_height * s)) for s in BUDGET_SCALES))
+    for ladder in (COLOR_LADDER, LOW_COLOR_LADDER):
+        for height in heights:
+            for depth, bits in ladder:
+                if depth <= max_depth:
+                    yield height, depth, bits
+
+def fit_budget(base, max_bytes, render, max_height, max_depth, bg_color=(0, 0, 0), brightness=1.0, dither=None, stats=None):
+    """
+    Picks the best settings whose encoded size fits max_bytes.
+    base is the image at max_height; render(img) finishes it (crop and
+    padding). Sizes are estimated from the cells; the first estimate that
+    fits is encoded for real and, should it still overflow, the search
+    carries on. The last candidate is used if nothing fits.
+    Returns (BudgetChoice, lines).
+    """
+    options = list(candidates(max_height, max_depth))
+    for i, (height, depth, bits) in enumerate(options):
+        last = i == len(options) - 1
+        with stage("budget"):
+            img = base
+            if height < max_height:
+                scale = height / max_height
+                size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+                img = base.resize(size, Image.LANCZOS)
+            img = render(reduce_precision(img, bits) if depth == 24 else img)
+            top, bottom = image_to_cells(img, bg_color=bg_color, brightness=brightness, depth=depth, dither=dither)
+            estimate = estimate_size(top, bottom, depth)
+            count("budget_candidates")
+        if estimate > max_bytes and not last:
+            continue
+        choice = BudgetChoice(height, depth, bits, estimate)
+        encoded = EncodeStats()
+        lines = encode_halfblock(top, bottom, depth, optimize=True, stats=encoded)
+        choice.size = encoded.bytes_out + len(lines)
+        if choice.size <= max_bytes or last:
+            if stats is not None:
+                stats.cells += encoded.cells
+                stats.bytes_out += encoded.bytes_out
+                stats.bytes_naive += encoded.bytes_naive
+            return choice, lines
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from .fontindex import cache_dir
+from .instrument import count
+
+# Bump when the rendered output format changes incompatibly
+CACHE_FORMAT = 1
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Rescan the cache at least this often, to notice other processes' writes
+EVICT_INTERVAL = 256
+# Eviction trims to this fraction of max_bytes, leaving room for a run of
+# writes before the next scan
+EVICT_TARGET = 0.9
+
+def ansify_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version("ansify")
+    except PackageNotFoundError:
+        return "0.0.0"
+
+def cache_enabled(flag=None) -> bool:
+    """An explicit --cache/--no-cache flag wins over ANSIFY_CACHE=1."""
+    if flag is not None:
+        return flag
+    return os.environ.get("ANSIFY_CACHE", "") not in ("", "0")
+
+class RenderCache:
+    """
+    Content-addressed on-disk cache of rendered ANSI output.
+    Keys hash the input bytes together with every rendering parameter and
+    the ansify version. Entries are written atomically (temp file plus
+    os.replace) so concurrent processes never see partial files, and the
+    least recently used entries are evicted once the cache exceeds
+    max_bytes. Writes keep a running size estimate, so the directory is
+    only scanned when that crosses max_bytes or every EVICT_INTERVAL puts.
+    hits and misses count this instance's lookups.
+    """
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.path.join(cache_dir(), "render")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # Estimated bytes on disk; None until scanned
+        self._puts = 0
+
+    def key(self, kind: str, data: bytes, **params) -> str:
+        header = json.dumps(
+            {"kind": kind, "format": CACHE_FORMAT, "version": ansify_version(), "params": params},
+            sort_keys=True, default=str,
+        )
+        h = hashlib.sha256(header.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            self.misses += 1
+            count("cache_misses")
+            return None
+        self.hits += 1
+        count("cache_hits")
+        try:
+            os.utime(path)  # Refresh LRU position
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._puts += 1
+        if self._size is not None:
+            self._size += len(value)
+        if self._size is None or self._size > self.max_bytes or self._puts % EVICT_INTERVAL == 0:
+            self.evict()
+
+    def tee(self, key: str, chunks):
+        """Yields chunks unchanged and stores their concatenation at the end."""
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(key, b"".join(parts))
+
+    def _entries(self):
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                entries.append((st.st_mtime_ns, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Once over max_bytes, deletes least recently used entries until
+        under EVICT_TARGET of it.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * EVICT_TARGET if total > self.max_bytes else self.max_bytes
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._size = 0
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+def cached_bytes(cache, key, produce, stats=None) -> bytes:
+    """
+    Returns the cached value for key, or produce() stored under it.
+    Hits are added to stats (an encode.EncodeStats), if given.
+    """
+    if cache is None:
+        return produce()
+    value = cache.get(key)
+    if value is None:
+        value = produce()
+        cache.put(key, value)
+    elif stats is not None:
+        stats.add_cached(value)
+    return value
@@ -1,6 +1,80 @@
-def combine_ansi_horizontally(*streams) -> str:
-    lines_list = [s.splitlines() for s in streams]
-    out = ""
-    for line_group in zip(*lines_list):
-        out += ''.join(line_group) + '\n'
-    return out
+import re
+import unicodedata
+
+from functools import lru_cache
+
+RESET = "\x1b[0m"
+
+# CSI sequences (SGR, cursor moves, ...) and two-byte escapes take no columns
+ESCAPE_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|[@-Z\\-_])")
+
+@lru_cache(maxsize=4096)
+def _char_width(ch: str) -> int:
+    if unicodedata.combining(ch) or ch in "\u200b\u200d\ufe0f":
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+
+def visible_width(line: str) -> int:
+    """Terminal columns taken by line, skipping escape sequences."""
+    text = ESCAPE_RE.sub("", line)
+    if text.isascii():
+        return len(text)
+    # Art repeats a handful of glyphs, so correct per distinct character
+    return len(text) + sum(
+        (_char_width(ch) - 1) * text.count(ch) for ch in set(text) if not ch.isascii()
+    )
+
+def pad_line(line: str, width: int, line_width=None) -> str:
+    """
+    Resets colors, unless line already ends with a reset, and pads line
+    with spaces to width visible columns.
+    """
+    if line_width is None:
+        line_width = visible_width(line)
+    if line and not line.endswith(RESET):
+        line += RESET
+    missing = width - line_width
+    return line + " " * missing if missing > 0 else line
+
+def _measured(stream):
+    if isinstance(stream, str):
+        stream = stream.splitlines()
+    for line in stream:
+        line = line.rstrip("\r\n")
+        yield line, visible_width(line)
+
+def _join(sources, widths, sep):
+    live = len(sources)
+    last = len(sources) - 1
+    while True:
+        parts = []
+        for i, source in enumerate(sources):
+            item = next(source, None) if source is not None else None
+            if item is None:
+                if source is not None:
+                    sources[i] = None
+                    live -= 1
+                item = ("", 0)
+            line, line_width = item
+            widths[i] = max(widths[i], line_width)
+            # Trailing spaces after the last panel would show nothing
+            parts.append(pad_line(line, widths[i] if i < last else 0, line_width))
+        if not live:
+            return
+        yield sep.join(parts)
+
+def iter_combined(*streams, sep=""):
+    """
+    Lazily joins streams of ANSI lines side by side.
+    Streams are strings or iterables of lines (such as open files or
+    pipes); a line is read from each and the joined line is yielded as
+    soon as every stream has one ready. Each panel is padded to the widest
+    line seen so far in it, and streams that end early leave blank columns.
+    """
+    return _join([_measured(s) for s in streams], [0] * len(streams), sep)
+
+def combine_ansi_horizontally(*streams, sep="") -> str:
+    """Joins whole ANSI strings side by side, padding each to its widest line."""
+    panels = [list(_measured(s)) for s in streams]
+    widths = [max((w for _, w in lines), default=0) for lines in panels]
+    return "".join(line + "\n" for line in _join([iter(p) for p in panels], widths, sep))
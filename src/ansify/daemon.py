@@ -0,0 +1,182 @@
+import io
+import json
+import os
+import socket
+import sys
+
+from .fontindex import cache_dir
+
+# Commands a daemon can run; the rest always run in-process
+DAEMON_COMMANDS = ("img", "text", "qr", "comp")
+
+# Requests allowed to wait for a worker, per worker, before clients block
+QUEUE_PER_WORKER = 4
+
+def socket_path() -> str:
+    """ANSIFY_SOCKET, else ansify.sock in the runtime (or cache) directory."""
+    path = os.environ.get("ANSIFY_SOCKET")
+    if path:
+        return path
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or cache_dir(), "ansify.sock")
+
+# Messages in both directions are one JSON header line followed by the
+# blobs whose lengths it lists under "sizes".
+
+def _encode_message(header: dict, blobs) -> bytes:
+    header = dict(header, sizes=[len(b) for b in blobs])
+    return json.dumps(header).encode("utf-8") + b"\n" + b"".join(blobs)
+
+def _read_message(f):
+    line = f.readline()
+    if not line.endswith(b"\n"):
+        raise ConnectionError("daemon closed the connection")
+    header = json.loads(line)
+    blobs = [f.read(n) for n in header["sizes"]]
+    if any(len(b) != n for b, n in zip(blobs, header["sizes"])):
+        raise ConnectionError("truncated message from daemon")
+    return header, blobs
+
+def connect(path=None):
+    """A socket connected to the daemon, or None when none is listening."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def request(sock, argv, inputs) -> tuple[int, bytes, bytes]:
+    """
+    Runs argv on the daemon behind sock, with inputs mapping file names
+    on the command line to their contents. Returns (exit status,
+    stdout bytes, stderr bytes).
+    """
+    names = list(inputs)
+    with sock:
+        sock.sendall(_encode_message({"argv": argv, "inputs": names}, [inputs[n] for n in names]))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as f:
+            header, (out, err) = _read_message(f)
+    return header["status"], out, err
+
+def forward(argv, files=(), path=None):
+    """
+    Client side of `ansify --daemon`: runs argv on the daemon and copies
+    its output to ours. files are read here and sent along, so pipes and
+    relative paths work. Returns the exit status, or None when no daemon
+    is listening and the caller should render in-process.
+    """
+    from .output import stderr, stdout_buffer
+    sock = connect(path)
+    if sock is None:
+        return None
+    inputs = {}
+    try:
+        for name in files:
+            with open(name, "rb") as f:
+                inputs[name] = f.read()
+    except OSError as e:
+        sock.close()
+        print(f"ansify: {type(e).__name__}: {e}", file=stderr())
+        return 1
+    try:
+        status, out, err = request(sock, argv, inputs)
+    except OSError:
+        return None  # The daemon died or hung up: render in-process
+    stdout_buffer().write(out)
+    stdout_buffer().flush()
+    stderr().write(err.decode("utf-8", errors="replace"))
+    return status
+
+def run_request(argv, inputs) -> tuple[int, bytes, bytes]:
+    """
+    Runs one client's command with its output captured. Only
+    DAEMON_COMMANDS are accepted; anything else exits with status 2.
+    """
+    from . import _main
+    from .output import redirect
+    out = io.BytesIO()
+    err = io.StringIO()
+    with redirect(out, err, inputs):
+        try:
+            status = _main(argv, commands=DAEMON_COMMANDS)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"ansify: {type(e).__name__}: {e}", file=err)
+            status = 1
+    return status, out.getvalue(), err.getvalue().encode("utf-8")
+
+def warm():
+    """Imports the renderers and builds the tables every request needs."""
+    import qrcode  # noqa: F401
+    from . import font, grid, img  # noqa: F401
+    from .fontindex import load_index
+    from .palette import ansi16_lut, ansi256_luts, mono_luts
+    ansi256_luts()
+    ansi16_lut()
+    mono_luts()
+    load_index()
+
+def serve(path=None, workers=None):
+    """
+    Runs the render daemon on a Unix socket until SIGINT or SIGTERM. Requests
+    run on a pool of worker threads sharing warm font, glyph and palette
+    caches; at most QUEUE_PER_WORKER requests per worker wait for one.
+    """
+    import asyncio
+    path = path or socket_path()
+    workers = workers or os.cpu_count() or 1
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise RuntimeError(f"a daemon is already listening on {path}")
+    if os.path.exists(path):
+        os.unlink(path)  # Left behind by a daemon that died
+    warm()
+    try:
+        asyncio.run(_serve(path, workers))
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+async def _serve(path, workers):
+    import asyncio
+    import signal
+    from concurrent.futures import ThreadPoolExecutor
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    slots = asyncio.Semaphore(workers * QUEUE_PER_WORKER)
+    with ThreadPoolExecutor(workers, thread_name_prefix="ansify") as executor:
+        handler = lambda reader, writer: _handle(reader, writer, executor, slots)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Create the socket owner-only from the start, not chmod it after
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(handler, path)
+        finally:
+            os.umask(umask)
+        print(f"ansify: serving on {path} with {workers} workers", file=sys.stderr)
+        async with server:
+            await stop.wait()
+
+async def _handle(reader, writer, executor, slots):
+    import asyncio
+    try:
+        header = json.loads(await reader.readline())
+        blobs = [await reader.readexactly(n) for n in header["sizes"]]
+        inputs = dict(zip(header["inputs"], blobs))
+        async with slots:
+            loop = asyncio.get_running_loop()
+            status, out, err = await loop.run_in_executor(executor, run_request, header["argv"], inputs)
+        writer.write(_encode_message({"status": status}, [out, err]))
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError, KeyError):
+        pass  # Client went away or sent garbage
+    finally:
+        writer.close()
@@ -0,0 +1,186 @@
+from functools import lru_cache
+
+import numpy as np
+
+from .palette import ANSI16_RGB, ansi256_rgb, quantize
+
+DITHER_METHODS = ("bayer", "blue-noise", "floyd-steinberg", "atkinson")
+# Methods whose result depends on the pixels above, not just on position
+ERROR_DIFFUSION = ("floyd-steinberg", "atkinson")
+
+# Error diffusion kernels as (dy, dx, weight); Atkinson drops 1/4 of the
+# error, which keeps highlights and shadows clean
+FLOYD_STEINBERG = ((0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16))
+ATKINSON = ((0, 1, 1 / 8), (0, 2, 1 / 8), (1, -1, 1 / 8), (1, 0, 1 / 8), (1, 1, 1 / 8), (2, 0, 1 / 8))
+
+# Ordered dither amplitude at depths without a color cube
+ORDERED_SPREAD = {4: 96, 1: 255}
+
+BAYER_SIZE = 8
+BLUE_NOISE_SIZE = 32
+BLUE_NOISE_SEED = 1234
+
+@lru_cache(maxsize=None)
+def palette_rgb(depth: int) -> np.ndarray:
+    """(N, 3) float32 colors of the codes quantize() returns for depth."""
+    if depth == 8:
+        return ansi256_rgb().astype(np.float32)
+    if depth == 4:
+        return np.array(ANSI16_RGB, dtype=np.float32)
+    if depth == 1:
+        return np.array([(0, 0, 0), (255, 255, 255)], dtype=np.float32)
+    raise ValueError(f"Cannot dither to color depth {depth}. Use 1, 4 or 8 bits.")
+
+@lru_cache(maxsize=None)
+def bayer_matrix(n=BAYER_SIZE) -> np.ndarray:
+    """n x n Bayer threshold offsets in [-0.5, 0.5); n is a power of two."""
+    m = np.zeros((1, 1))
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return ((m + 0.5) / m.size - 0.5).astype(np.float32)
+
+@lru_cache(maxsize=None)
+def blue_noise_matrix(n=BLUE_NOISE_SIZE, seed=BLUE_NOISE_SEED) -> np.ndarray:
+    """
+    n x n blue-noise threshold offsets in [-0.5, 0.5), built with
+    Ulichney's void-and-cluster method on a torus so the tile repeats
+    seamlessly. Deterministic for a given seed.
+    """
+    d = np.minimum(np.arange(n), n - np.arange(n))
+    kernel = np.exp(-(d[:, None] ** 2 + d[None, :] ** 2) / (2 * 1.5 ** 2))
+    ones = np.zeros((n, n), dtype=bool)
+    energy = np.zeros((n, n))
+
+    def toggle(i, on):
+        y, x = divmod(i, n)
+        ones[y, x] = on
+        energy[...] += np.roll(kernel, (y, x), axis=(0, 1)) * (1 if on else -1)
+
+    def tightest_cluster():
+        return int(np.argmax(np.where(ones, energy, -np.inf)))
+
+    def largest_void():
+        return int(np.argmin(np.where(ones, np.inf, energy)))
+
+    for i in np.random.default_rng(seed).choice(n * n, n * n // 10, replace=False).tolist():
+        toggle(i, True)
+    # Spread the initial points out until moving one no longer helps
+    while True:
+        i = tightest_cluster()
+        toggle(i, False)
+        j = largest_void()
+        toggle(j, True)
+        if i == j:
+            break
+
+    rank = np.empty(n * n, dtype=np.int32)
+    prototype, prototype_energy = ones.copy(), energy.copy()
+    for r in range(int(ones.sum()) - 1, -1, -1):
+        i = tightest_cluster()
+        toggle(i, False)
+        rank[i] = r
+    ones[...], energy[...] = prototype, prototype_energy
+    for r in range(int(ones.sum()), n * n):
+        i = largest_void()
+        toggle(i, True)
+        rank[i] = r
+    return ((rank.reshape(n, n) + 0.5) / rank.size - 0.5).astype(np.float32)
+
+@lru_cache(maxsize=None)
+def cube_levels() -> tuple[np.ndarray, np.ndarray]:
+    """
+    For every channel value, the 0..5 xterm cube level at or below it and
+    how far (0..1) it lies towards the next one.
+    """
+    levels = np.array([0, 95, 135, 175, 215, 255])
+    v = np.arange(256)
+    lower = np.clip(np.searchsorted(levels, v, side="right") - 1, 0, 4)
+    frac = (v - levels[lower]) / (levels[lower + 1] - levels[lower])
+    return lower.astype(np.int32), frac.astype(np.float32)
+
+def ordered_dither(pixels: np.ndarray, depth: int, matrix: np.ndarray, y0=0) -> np.ndarray:
+    """
+    Quantizes (H, W, 3) uint8 pixels against a tiled threshold matrix.
+    y0 is the image row of pixels[0], so that bands line up. At depth 8
+    each channel picks between the two xterm cube levels around it, which
+    keeps local averages exact; at depths 4 and 1, whose palettes are no
+    cube, pixels are offset by the threshold before the usual mapping.
+    """
+    h, w = pixels.shape[:2]
+    n = matrix.shape[0]
+    thresholds = matrix[np.arange(y0, y0 + h) % n][:, np.arange(w) % n]
+    if depth == 8:
+        lower, frac = cube_levels()
+        level = lower[pixels] + (frac[pixels] > thresholds[..., None] + 0.5)
+        return 16 + 36 * level[..., 0] + 6 * level[..., 1] + level[..., 2]
+    offsets = np.rint(thresholds * ORDERED_SPREAD[depth]).astype(np.int16)
+    shifted = np.clip(pixels.astype(np.int16) + offsets[..., None], 0, 255).astype(np.uint8)
+    return quantize(shifted, depth)
+
+@lru_cache(maxsize=None)
+def diffusion_lut(depth: int) -> np.ndarray:
+    """
+    quantize() for depth over a 6-bit-per-channel grid, indexed by
+    (r >> 2) << 12 | (g >> 2) << 6 | b >> 2. Coarse, but error diffusion
+    carries the difference to the exact palette color forward.
+    """
+    centers = (np.arange(64) << 2) + 2
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).astype(np.uint8)
+    return quantize(grid, depth).astype(np.int32).ravel()
+
+def diffuse(pixels: np.ndarray, depth: int, kernel=FLOYD_STEINBERG) -> np.ndarray:
+    """
+    Error-diffusion dithering of (H, W, 3) uint8 pixels to color codes.
+    With kernels that only push error right and down, pixel (x, y) depends
+    only on pixels with a smaller x + 2y, so each such anti-diagonal is
+    quantized and spreads its error in one vectorized step: W + 2H steps
+    rather than W * H.
+    """
+    h, w = pixels.shape[:2]
+    palette = palette_rgb(depth)
+    lut = diffusion_lut(depth)
+    pad = max(abs(dx) for _, dx, _ in kernel)
+    stride = w + 2 * pad
+    reach = max(dy for dy, _, _ in kernel)
+    work = np.zeros((h + reach, stride, 3), dtype=np.float32)
+    work[:h, pad:pad + w] = pixels
+    flat = work.reshape(-1, 3)
+    codes = np.zeros(flat.shape[0], dtype=np.int32)
+    taps = {}
+    for dy, dx, weight in kernel:
+        taps.setdefault(np.float32(weight), []).append(dy * stride + dx)
+    bin_weights = np.array([1 << 12, 1 << 6, 1], dtype=np.int32)
+    # Pixel (t - 2y, y) sits at flat index y * (stride - 2) + t + pad, so
+    # each anti-diagonal, and each of its error targets, is a strided slice
+    step = stride - 2
+    for t in range(w + 2 * (h - 1)):
+        y0, y1 = max(0, (t - w + 2) // 2), min(h - 1, t // 2) + 1
+        start = y0 * step + t + pad
+        stop = start + (y1 - y0) * step
+        values = np.maximum(flat[start:stop:step], 0)
+        np.minimum(values, 255, out=values)
+        q = lut[(values.astype(np.int32) >> 2) @ bin_weights]
+        codes[start:stop:step] = q
+        error = values - palette[q]
+        for weight, offsets in taps.items():
+            share = error * weight
+            for offset in offsets:
+                flat[start + offset:stop + offset:step] += share
+    return codes.reshape(h + reach, stride)[:h, pad:pad + w]
+
+def dither(pixels: np.ndarray, depth: int, method: str, y0=0) -> np.ndarray:
+    """
+    Color codes for (H, W, 3) uint8 pixels at depth (see quantize) using
+    a dither method from DITHER_METHODS. 24-bit output needs no dithering.
+    """
+    if depth == 24:
+        return quantize(pixels, depth)
+    if method == "bayer":
+        return ordered_dither(pixels, depth, bayer_matrix(), y0)
+    if method == "blue-noise":
+        return ordered_dither(pixels, depth, blue_noise_matrix(), y0)
+    if method == "floyd-steinberg":
+        return diffuse(pixels, depth, FLOYD_STEINBERG)
+    if method == "atkinson":
+        return diffuse(pixels, depth, ATKINSON)
+    raise ValueError(f"Unknown dither method: {method}. Use one of {', '.join(DITHER_METHODS)}.")
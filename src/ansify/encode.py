@@ -0,0 +1,275 @@
+import numpy as np
+
+from .dither import ERROR_DIFFUSION, dither as dither_codes
+from .instrument import count
+from .palette import quantize
+
+UPPER_HALF = "▀"
+LOWER_HALF = "▄"
+FULL_BLOCK = "█"
+RESET = "\x1b[0m"
+
+def image_to_array(img) -> np.ndarray:
+    """Return img as a single (H, W, 4) uint8 RGBA array."""
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    return np.asarray(img, dtype=np.uint8)
+
+def pad_to_even(arr: np.ndarray, bg_color) -> np.ndarray:
+    """Append an opaque bg_color row so every top row has a bottom partner."""
+    h, w, _ = arr.shape
+    if h % 2 == 0:
+        return arr
+    row = np.empty((1, w, 4), dtype=np.uint8)
+    row[..., :3] = bg_color[:3]
+    row[..., 3] = 255
+    return np.concatenate([arr, row], axis=0)
+
+def blend_pixels(arr: np.ndarray, bg_color, brightness) -> np.ndarray:
+    """
+    Alpha-blends RGBA pixels over bg_color and scales by brightness.
+    Mirrors the per-pixel float math of the original encoders exactly.
+    Returns an (H, W, 3) uint8 array.
+    """
+    rgb = arr[..., :3].astype(np.int32)
+    a = arr[..., 3:4].astype(np.int32)
+    bg = np.asarray(bg_color[:3], dtype=np.int32)
+    out = (rgb * a + bg * (255 - a)) / 255 * brightness
+    return np.clip(np.trunc(out), 0, 255).astype(np.uint8)
+
+class _SgrTable(dict):
+    """Memoizes the SGR parameter string for each color code."""
+    def __init__(self, fmt):
+        super().__init__()
+        self.fmt = fmt
+
+    def __missing__(self, code):
+        params = self[code] = self.fmt(code)
+        return params
+
+def _rgb_params(prefix):
+    return lambda c: f"{prefix};2;{c >> 16};{(c >> 8) & 255};{c & 255}"
+
+def _index_params(prefix):
+    return lambda c: f"{prefix};5;{c}"
+
+def _ansi16_params(normal, bright):
+    return lambda c: f"{normal + c}" if c < 8 else f"{bright + c - 8}"
+
+SGR_FG = {
+    24: _SgrTable(_rgb_params(38)),
+    8: _SgrTable(_index_params(38)),
+    4: _SgrTable(_ansi16_params(30, 90)),
+}
+SGR_BG = {
+    24: _SgrTable(_rgb_params(48)),
+    8: _SgrTable(_index_params(48)),
+    4: _SgrTable(_ansi16_params(40, 100)),
+}
+
+# Monochrome glyphs indexed by (top_lit << 1) | bottom_lit
+MONO_GLYPHS = (" ", LOWER_HALF, UPPER_HALF, FULL_BLOCK)
+
+class EncodeStats:
+    """
+    Accumulates output size counters across encode calls. Output served
+    from the render cache counts towards bytes_out but not the savings,
+    as its unoptimized size is unknown.
+    """
+    def __init__(self):
+        self.cells = 0
+        self.bytes_out = 0
+        self.bytes_naive = 0
+        self.cache_hits = 0
+        self.bytes_cached = 0
+
+    def add_cached(self, data: bytes):
+        self.cache_hits += 1
+        self.bytes_cached += len(data)
+        self.bytes_out += len(data)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_naive - (self.bytes_out - self.bytes_cached)
+
+    def __str__(self):
+        pct = 100 * self.bytes_saved / self.bytes_naive if self.bytes_naive else 0.0
+        out = f"{self.cells} cells, {self.bytes_out} bytes (saved {self.bytes_saved} bytes, {pct:.1f}%)"
+        if self.cache_hits:
+            out += f", {self.cache_hits} cached ({self.bytes_cached} bytes)"
+        return out
+
+def _digits(a: np.ndarray) -> np.ndarray:
+    return 1 + (a >= 10) + (a >= 100)
+
+def _params_len(codes: np.ndarray, depth: int, bg: bool) -> np.ndarray:
+    """Vectorized length of the SGR parameter string for each code."""
+    if depth == 24:
+        return 7 + _digits(codes >> 16) + _digits((codes >> 8) & 255) + _digits(codes & 255)
+    if depth == 8:
+        return 5 + _digits(codes)
+    return 2 + (bg & (codes >= 8))
+
+def naive_size(top: np.ndarray, bottom: np.ndarray, depth: int) -> int:
+    """Bytes the unoptimized encoder emits for these codes."""
+    if depth == 1:
+        glyphs = (top << 1) | bottom
+        return int(np.where(glyphs == 0, 1, 3).sum())
+    # "\x1b[" fg ";" bg "m" + 3-byte glyph per cell, RESET per line
+    per_cell = 7 + _params_len(top, depth, False) + _params_len(bottom, depth, True)
+    return int(per_cell.sum()) + 4 * top.shape[0]
+
+def _encode_line(top_row, bottom_row, starts, fg, bg) -> str:
+    """
+    Emits one line, tracking the current fg/bg and writing only the
+    SGR parameters that change. Cells whose halves match are drawn as a
+    space or full block; split cells may flip to a lower half block if
+    that avoids a color change. starts holds the run boundaries of
+    identical cells, which always repeat the same glyph without escapes.
+    """
+    out = []
+    cur_fg = cur_bg = None
+    for start, end in zip(starts, starts[1:]):
+        t, b = top_row[start], bottom_row[start]
+        params = []
+        if t == b:
+            if cur_bg == t:
+                glyph = " "
+            elif cur_fg == t:
+                glyph = FULL_BLOCK
+            else:
+                params.append(bg[t])
+                cur_bg = t
+                glyph = " "
+        else:
+            if (cur_fg != t) + (cur_bg != b) > (cur_fg != b) + (cur_bg != t):
+                t, b = b, t
+                glyph = LOWER_HALF
+            else:
+                glyph = UPPER_HALF
+            if cur_fg != t:
+                params.append(fg[t])
+                cur_fg = t
+            if cur_bg != b:
+                params.append(bg[b])
+                cur_bg = b
+        if params:
+            out.append(f"\x1b[{';'.join(params)}m")
+        out.append(glyph * (end - start))
+    out.append(RESET)
+    return "".join(out)
+
+def _run_boundaries(top: np.ndarray, bottom: np.ndarray) -> np.ndarray:
+    """(rows, W + 1) mask marking where runs of identical cells start or end."""
+    rows, w = top.shape
+    change = np.ones((rows, w + 1), dtype=bool)
+    change[:, 1:w] = (top[:, 1:] != top[:, :-1]) | (bottom[:, 1:] != bottom[:, :-1])
+    return change
+
+def encode_halfblock(top: np.ndarray, bottom: np.ndarray, depth: int, optimize=False, stats=None) -> list[str]:
+    """
+    Assembles half-block lines from (rows, W) top/bottom color codes.
+    Returns a list of strings, one per row, each ending in a reset.
+    Depth 1 emits no escapes at all, only block glyphs for lit pixels.
+    optimize: elide SGR parameters that match the current line state.
+    stats: optional EncodeStats to accumulate into.
+    """
+    if depth == 1:
+        glyphs = ((top << 1) | bottom).tolist()
+        lines = ["".join([MONO_GLYPHS[g] for g in row]) for row in glyphs]
+    elif optimize:
+        fg, bg = SGR_FG[depth], SGR_BG[depth]
+        change = _run_boundaries(top, bottom)
+        lines = [
+            _encode_line(top_row, bottom_row, np.flatnonzero(row_change).tolist(), fg, bg)
+            for top_row, bottom_row, row_change in zip(top.tolist(), bottom.tolist(), change)
+        ]
+    else:
+        fg, bg = SGR_FG[depth], SGR_BG[depth]
+        lines = []
+        for top_row, bottom_row in zip(top.tolist(), bottom.tolist()):
+            cells = [f"\x1b[{fg[t]};{bg[b]}m{UPPER_HALF}" for t, b in zip(top_row, bottom_row)]
+            cells.append(RESET)
+            lines.append("".join(cells))
+    count("cells", top.size)
+    if stats is not None:
+        stats.cells += top.size
+        stats.bytes_naive += naive_size(top, bottom, depth)
+        stats.bytes_out += sum(len(line.encode("utf-8")) for line in lines)
+    return lines
+
+def pixel_codes(pixels: np.ndarray, depth: int, dither=None, y0=0) -> np.ndarray:
+    """quantize(), or a dither.DITHER_METHODS method; y0 is pixels' first image row."""
+    if dither is None:
+        return quantize(pixels, depth)
+    return dither_codes(pixels, depth, dither, y0)
+
+def image_to_cells(img, bg_color=(0, 0, 0), brightness=1.0, depth=24, dither=None) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the (rows, W) top and bottom color codes of img's half-block cells."""
+    arr = pad_to_even(image_to_array(img), bg_color)
+    codes = pixel_codes(blend_pixels(arr, bg_color, brightness), depth, dither)
+    return codes[0::2], codes[1::2]
+
+def encode_image(img, bg_color=(0, 0, 0), brightness=1.0, depth=24, optimize=False, stats=None, dither=None) -> list[str]:
+    """
+    Encodes a PIL image as half-block ANSI lines.
+    The image is blended, scaled and palette-mapped as whole arrays; only
+    the final string assembly runs per cell (or per run when optimizing).
+    """
+    top, bottom = image_to_cells(img, bg_color=bg_color, brightness=brightness, depth=depth, dither=dither)
+    return encode_halfblock(top, bottom, depth, optimize=optimize, stats=stats)
+
+def iter_encoded_bands(img, bg_color=(0, 0, 0), brightness=1.0, depth=24, optimize=False, stats=None, band_rows=16, dither=None):
+    """
+    Yields the encoded image as UTF-8 bytes, band_rows lines at a time.
+    Only one band is blended and quantized at once, so memory stays
+    bounded by the band size and the first rows are ready immediately.
+    Error diffusion needs the rows above, so it maps the whole image first.
+    """
+    arr = image_to_array(img)
+    step = 2 * band_rows
+    if dither in ERROR_DIFFUSION:
+        arr = pad_to_even(arr, bg_color)
+        codes = pixel_codes(blend_pixels(arr, bg_color, brightness), depth, dither)
+        bands = (codes[y:y + step] for y in range(0, arr.shape[0], step))
+    else:
+        bands = (
+            pixel_codes(blend_pixels(pad_to_even(arr[y:y + step], bg_color), bg_color, brightness), depth, dither, y)
+            for y in range(0, arr.shape[0], step)
+        )
+    for codes in bands:
+        lines = encode_halfblock(codes[0::2], codes[1::2], depth, optimize=optimize, stats=stats)
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def _cursor_move(dy: int, x: int) -> str:
+    """Relative vertical move plus absolute column (0-based x)."""
+    if dy < 0:
+        return f"\x1b[{-dy}A\x1b[{x + 1}G"
+    if dy > 0:
+        return f"\x1b[{dy}B\x1b[{x + 1}G"
+    return f"\x1b[{x + 1}G"
+
+def encode_damage(prev_top, prev_bottom, top, bottom, depth) -> str:
+    """
+    Encodes only the cells that differ from the previously emitted grid,
+    positioning the cursor before each changed span. Expects the cursor
+    at column 1 of the line just below the grid and leaves it there.
+    Returns an empty string when nothing changed.
+    """
+    changed = (top != prev_top) | (bottom != prev_bottom)
+    if not changed.any():
+        return ""
+    rows = top.shape[0]
+    edges = np.diff(changed.astype(np.int8), axis=1, prepend=0, append=0)
+    out = []
+    cur_y = rows
+    for y in np.flatnonzero(changed.any(axis=1)).tolist():
+        starts = np.flatnonzero(edges[y] == 1).tolist()
+        ends = np.flatnonzero(edges[y] == -1).tolist()
+        for x0, x1 in zip(starts, ends):
+            out.append(_cursor_move(y - cur_y, x0))
+            cur_y = y
+            span = encode_halfblock(top[y:y + 1, x0:x1], bottom[y:y + 1, x0:x1], depth, optimize=True)
+            out.append(span[0])
+    out.append(f"\x1b[{rows - cur_y}B\r")
+    return "".join(out)
@@ -1,17 +1,27 @@
+import os
+import threading
 import numpy as np
 
-from matplotlib.font_manager import FontProperties, findfont
+from collections import OrderedDict
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 from typing import List, Literal, Callable
 
 from .term import get_terminal_color_depth
-from .img import AnsiImageRenderer, img_to_ansi
+from .img import AnsiImageRenderer, img_to_ansi, resolve_depth
+from .cache import cached_bytes
+from .fontindex import find_font, font_names
+from .instrument import stage
 
 # Colors: choose ANSI256 codes for ON/OFF pixels
 FG_ON = 12   # Bright white (ANSI 15)
 FG_OFF = 16  # Black (ANSI 16)
 THRESHOLD = 128  # Midpoint for 8-bit (0=black, 255=white)
 
+# Cache sizes for resolved fonts and rasterized glyphs
+FONT_CACHE_SIZE = 64
+GLYPH_CACHE_SIZE = 4096
+
 def adjust_image_levels(img: Image.Image, black=0, white=255) -> Image.Image:
     """Linearly stretch RGBA so black→0, white→255 for R,G,B,A."""
     img = img.convert("RGBA")
@@ -48,28 +58,133 @@ def text_to_image(text, font_path, font_size, color=(255,255,255), bg=(0,0,0,0))
     draw.text((-bbox[0], -bbox[1]), text, font=font, fill=color)
     return img
 
+@lru_cache(maxsize=FONT_CACHE_SIZE)
 def font_from_name(font_name):
-    prop = FontProperties(family=font_name)
-    try:
-        return findfont(prop, fallback_to_default=False)  # raises error if not found
-    except ValueError:
+    path = find_font(font_name)
+    if path is None:
         raise ValueError(f"Font '{font_name}' not found")
+    return path
 
 def list_fonts() -> List[str]:
     """List all available fonts."""
-    from matplotlib.font_manager import fontManager
-    return [f.name for f in fontManager.ttflist]
+    return font_names()
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_path, font_size) -> ImageFont.FreeTypeFont:
+    """Cached ImageFont.truetype."""
+    return ImageFont.truetype(font_path, font_size)
+
+class GlyphAtlas:
+    """
+    LRU cache of rasterized glyphs keyed by (font path, size, character).
+    Each entry holds the glyph's alpha mask with levels already applied,
+    its offset from the pen position, and its advance width.
+    """
+    def __init__(self, maxsize=GLYPH_CACHE_SIZE, black=0, white=200):
+        self.maxsize = maxsize
+        self.black = black
+        self.white = white
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._lock = threading.Lock()  # Shared by the daemon's render threads
+
+    def get(self, font_path, font_size, char):
+        key = (font_path, font_size, char)
+        with self._lock:  # FreeType faces are not safe to share across threads either
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self.hits += 1
+                self._glyphs.move_to_end(key)
+                return glyph
+            self.misses += 1
+            glyph = self._rasterize(load_font(font_path, font_size), char)
+            self._glyphs[key] = glyph
+            if len(self._glyphs) > self.maxsize:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def _rasterize(self, font, char):
+        left, top, right, bottom = font.getbbox(char)
+        advance = font.getlength(char)
+        if right <= left or bottom <= top:
+            return np.zeros((0, 0), dtype=np.uint8), left, top, advance
+        img = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(img).text((-left, -top), char, font=font, fill=255)
+        alpha = np.asarray(img, dtype=np.float32)
+        alpha = (alpha - self.black) / (self.white - self.black) * 255
+        mask = np.clip(alpha, 0, 255).astype(np.uint8)
+        return mask, left, top, advance
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+        self.hits = self.misses = 0
+
+    def info(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._glyphs), "maxsize": self.maxsize}
+
+glyph_atlas = GlyphAtlas()
+
+def cache_info() -> dict:
+    """Hit/miss statistics for the font path, font object and glyph caches."""
+    def lru(fn):
+        info = fn.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return {"paths": lru(font_from_name), "fonts": lru(load_font), "glyphs": glyph_atlas.info()}
+
+def text_to_alpha(text, font_path, font_size, atlas=None) -> np.ndarray:
+    """
+    Composes a line of text from cached glyph masks.
+    Returns an (H, W) uint8 alpha mask cropped to the inked area.
+    """
+    atlas = atlas or glyph_atlas
+    placed = []
+    pen = 0.0
+    for char in text:
+        mask, left, top, advance = atlas.get(font_path, font_size, char)
+        if mask.size:
+            placed.append((mask, int(round(pen)) + left, top))
+        pen += advance
+    if not placed:
+        return np.zeros((0, 0), dtype=np.uint8)
+    x0 = min(x for _, x, _ in placed)
+    y0 = min(y for _, _, y in placed)
+    x1 = max(x + m.shape[1] for m, x, _ in placed)
+    y1 = max(y + m.shape[0] for m, _, y in placed)
+    out = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    for mask, x, y in placed:
+        h, w = mask.shape
+        region = out[y - y0:y - y0 + h, x - x0:x - x0 + w]
+        np.maximum(region, mask, out=region)
+    return out
+
+def colorize_alpha(alpha: np.ndarray, fg_color=(255, 255, 255), bg_color=(0, 0, 0)) -> Image.Image:
+    """Integer counterpart of colorize_image for a bare alpha mask."""
+    a = alpha[..., None].astype(np.uint16)
+    fg = np.asarray(fg_color[:3], dtype=np.uint16)
+    bg = np.asarray(bg_color[:3], dtype=np.uint16)
+    out = np.empty(alpha.shape + (4,), dtype=np.uint8)
+    out[..., :3] = (fg * a + bg * (255 - a)) // 255
+    out[..., 3] = alpha
+    return Image.fromarray(out, "RGBA")
 
-def text_to_ansi(line:str, font:str, size:int, background:tuple[int, int, int], foreground:tuple[int, int, int]) -> str:
-    # Adjust spacing
-    black_level = 0
-    white_level = 200
+def text_to_ansi(line:str, font:str, size:int, background:tuple[int, int, int], foreground:tuple[int, int, int], depth:int|None=None, optimize:bool=True, stats=None, cache=None) -> str:
     brightness=1.0
 
     font_path = font_from_name(font)
-    img = text_to_image(line, font_path, size)
-    img = adjust_image_levels(img, black_level, white_level)
-    img = colorize_image(img, fg_color=foreground, bg_color=background)
+    if cache is not None:
+        key = cache.key(
+            "text", line.encode("utf-8"), font=font_path, font_mtime=os.stat(font_path).st_mtime_ns,
+            size=size, background=tuple(background), foreground=tuple(foreground),
+            depth=resolve_depth(depth), optimize=optimize,
+        )
+        render = lambda: text_to_ansi(line, font_path, size, background, foreground, depth, optimize, stats).encode("utf-8")
+        return cached_bytes(cache, key, render, stats=stats).decode("utf-8")
+    with stage("rasterize"):
+        alpha = text_to_alpha(line, font_path, size)
+    with stage("colorize"):
+        img = colorize_alpha(alpha, fg_color=foreground, bg_color=background)
 
-    ansi_lines: list[str] = img_to_ansi(img, bg_color=background, brightness=brightness)
+    ansi_lines: list[str] = img_to_ansi(img, bg_color=background, brightness=brightness, depth=depth, optimize=optimize, stats=stats)
     return ("\n".join(ansi_lines))
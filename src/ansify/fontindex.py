@@ -0,0 +1,132 @@
+import json
+import os
+import sys
+
+from importlib.util import find_spec
+
+INDEX_VERSION = 1
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+# Styles preferred when a family name matches several faces
+REGULAR_STYLES = ("regular", "book", "roman", "normal", "medium")
+
+def cache_dir() -> str:
+    """Per-user cache directory for ansify."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ansify")
+
+def index_path() -> str:
+    return os.path.join(cache_dir(), "fonts.json")
+
+def font_dirs() -> list[str]:
+    """
+    Directories scanned for fonts: ANSIFY_FONT_PATH entries, the usual
+    system and user locations, and matplotlib's bundled fonts if it is
+    installed (located without importing it).
+    """
+    home = os.path.expanduser("~")
+    dirs = [d for d in os.environ.get("ANSIFY_FONT_PATH", "").split(os.pathsep) if d]
+    if sys.platform == "win32":
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        dirs.append(os.path.join(windir, "Fonts"))
+        local = os.environ.get("LOCALAPPDATA")
+        if local:
+            dirs.append(os.path.join(local, "Microsoft", "Windows", "Fonts"))
+    elif sys.platform == "darwin":
+        dirs += ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    else:
+        dirs += [
+            "/usr/share/fonts", "/usr/local/share/fonts",
+            os.path.join(home, ".fonts"), os.path.join(home, ".local", "share", "fonts"),
+        ]
+    spec = find_spec("matplotlib")
+    if spec is not None and spec.submodule_search_locations:
+        for location in spec.submodule_search_locations:
+            dirs.append(os.path.join(location, "mpl-data", "fonts", "ttf"))
+    return [d for d in dirs if os.path.isdir(d)]
+
+def _walk(dirs):
+    """Returns (directory mtime map, font file paths) for dirs, recursively."""
+    mtimes = {}
+    files = []
+    for root_dir in dirs:
+        for root, _, names in os.walk(root_dir):
+            mtimes[root] = os.stat(root).st_mtime_ns
+            files += [os.path.join(root, n) for n in names if n.lower().endswith(FONT_EXTENSIONS)]
+    return mtimes, files
+
+def _is_fresh(index, dirs) -> bool:
+    if index.get("version") != INDEX_VERSION or index.get("roots") != dirs:
+        return False
+    try:
+        return all(os.stat(d).st_mtime_ns == m for d, m in index["mtimes"].items())
+    except OSError:
+        return False
+
+def build_index(dirs) -> dict:
+    """Scans dirs and reads each font's family and style names."""
+    from PIL import ImageFont
+    mtimes, files = _walk(dirs)
+    fonts = []
+    for path in sorted(files):
+        try:
+            family, style = ImageFont.truetype(path, 10).getname()
+        except OSError:
+            continue
+        if family:
+            fonts.append({"name": family, "style": style or "", "path": path})
+    return {"version": INDEX_VERSION, "roots": dirs, "mtimes": mtimes, "fonts": fonts}
+
+def _save(index, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+
+_index = None
+
+def load_index(rebuild=False) -> dict:
+    """
+    Returns the font index, reading the on-disk copy when every scanned
+    directory's mtime still matches and rebuilding it otherwise.
+    """
+    global _index
+    dirs = font_dirs()
+    if _index is not None and not rebuild and _index["roots"] == dirs:
+        return _index
+    path = index_path()
+    index = None
+    if not rebuild:
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+    if index is None or not _is_fresh(index, dirs):
+        index = build_index(dirs)
+        try:
+            _save(index, path)
+        except OSError:
+            pass  # Read-only cache dir: keep the in-memory index
+    _index = index
+    return index
+
+def find_font(name: str) -> str | None:
+    """
+    Path of the best face for a family name (case-insensitive), preferring
+    regular styles. A path to an existing font file is returned as is.
+    """
+    if os.path.isfile(name):
+        return name
+    wanted = name.casefold()
+    matches = [f for f in load_index()["fonts"] if f["name"].casefold() == wanted]
+    if not matches:
+        return None
+    for font in matches:
+        if font["style"].casefold() in REGULAR_STYLES:
+            return font["path"]
+    return matches[0]["path"]
+
+def font_names() -> list[str]:
+    return [f["name"] for f in load_index()["fonts"]]
@@ -0,0 +1,236 @@
+import numpy as np
+
+from .encode import (
+    FULL_BLOCK, RESET, SGR_BG, SGR_FG, _params_len, blend_pixels, image_to_array,
+)
+from .instrument import count
+from .palette import quantize
+
+# Cell geometry (pixel columns, pixel rows) per encoding mode
+MODES = {
+    "half": (1, 2),
+    "quadrant": (2, 2),
+    "sextant": (2, 3),
+    "braille": (2, 4),
+}
+
+# Largest number of cells fitted at once, bounding the temporaries
+FIT_CHUNK_CELLS = 4096
+
+def _quadrant_glyphs():
+    # Bits: 0 top-left, 1 top-right, 2 bottom-left, 3 bottom-right
+    return list(" ▘▝▀▖▌▞▛▗▚▐▜▄▙▟█")
+
+def _sextant_glyphs():
+    # Bits in row-major order match Unicode's BLOCK SEXTANT-n numbering.
+    # The two half-column patterns live in the older block elements.
+    glyphs = []
+    for n in range(64):
+        if n == 0:
+            glyphs.append(" ")
+        elif n == 63:
+            glyphs.append(FULL_BLOCK)
+        elif n == 21:
+            glyphs.append("▌")
+        elif n == 42:
+            glyphs.append("▐")
+        else:
+            glyphs.append(chr(0x1FB00 + n - 1 - (n > 21) - (n > 42)))
+    return glyphs
+
+def _braille_glyphs():
+    # Row-major pixel bit -> braille dot bit (dots 1,4 / 2,5 / 3,6 / 7,8)
+    dots = (0, 3, 1, 4, 2, 5, 6, 7)
+    glyphs = []
+    for n in range(256):
+        code = sum(1 << dots[i] for i in range(8) if n >> i & 1)
+        glyphs.append(chr(0x2800 + code) if code else " ")
+    return glyphs
+
+GLYPHS = {
+    "half": [" ", "▀", "▄", FULL_BLOCK],
+    "quadrant": _quadrant_glyphs(),
+    "sextant": _sextant_glyphs(),
+    "braille": _braille_glyphs(),
+}
+
+# Whether a pattern drawn with swapped colors looks like its complement.
+# Braille dots don't tile the cell, so inverting them changes the picture.
+SWAPPABLE = {"half": True, "quadrant": True, "sextant": True, "braille": False}
+
+def _patterns(k):
+    """All fg/bg splits of k pixels with pixel 0 in the background."""
+    n = np.arange(1 << (k - 1), dtype=np.int32) << 1
+    bits = (n[:, None] >> np.arange(k)) & 1
+    return n, bits.astype(np.float32)
+
+def fit_cells(pixels: np.ndarray, mode: str):
+    """
+    Two-color fit of every cell in an (H, W, 3) uint8 image, H and W being
+    multiples of the mode's cell size. For each cell, every split of its
+    pixels into foreground and background is scored at once and the one
+    with the least squared error (colors = means of each side) wins.
+    Returns (fg, bg, pattern): (rows, cols, 3) uint8 colors and the
+    (rows, cols) pattern bits, bit i set when pixel i (row-major) is fg.
+    """
+    cw, ch = MODES[mode]
+    h, w, _ = pixels.shape
+    rows, cols = h // ch, w // cw
+    k = cw * ch
+    x = pixels.reshape(rows, ch, cols, cw, 3).transpose(0, 2, 1, 3, 4).reshape(-1, k, 3)
+    values, bits = _patterns(k)
+    n1 = bits.sum(axis=1)
+    n0 = k - n1
+    inv_n1 = np.where(n1 > 0, 1 / np.maximum(n1, 1), 0).astype(np.float32)
+    inv_n0 = (1 / n0).astype(np.float32)
+    fg = np.empty((x.shape[0], 3), dtype=np.float32)
+    bg = np.empty((x.shape[0], 3), dtype=np.float32)
+    pattern = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], FIT_CHUNK_CELLS):
+        chunk = x[start:start + FIT_CHUNK_CELLS].astype(np.float32)
+        total = chunk.sum(axis=1)                                  # (n, 3)
+        s1 = np.einsum("pk,nkc->npc", bits, chunk)                 # (n, p, 3)
+        s0 = total[:, None, :] - s1
+        # SSE = sum|x|^2 - |S1|^2/n1 - |S0|^2/n0, so maximize the rest
+        score = (s1 * s1).sum(axis=2) * inv_n1 + (s0 * s0).sum(axis=2) * inv_n0
+        best = score.argmax(axis=1)
+        idx = np.arange(len(best))
+        end = start + len(best)
+        pattern[start:end] = values[best]
+        bg[start:end] = s0[idx, best] * inv_n0[best][:, None]
+        fg[start:end] = np.where(
+            (n1[best] > 0)[:, None], s1[idx, best] * inv_n1[best][:, None], bg[start:end]
+        )
+    to_u8 = lambda a: np.clip(np.rint(a), 0, 255).astype(np.uint8).reshape(rows, cols, 3)
+    return to_u8(fg), to_u8(bg), pattern.reshape(rows, cols)
+
+def pad_to_cells(arr: np.ndarray, mode: str, bg_color) -> np.ndarray:
+    """Pads an (H, W, 4) RGBA array with opaque bg_color to whole cells."""
+    cw, ch = MODES[mode]
+    h, w, _ = arr.shape
+    ph, pw = -h % ch, -w % cw
+    if not ph and not pw:
+        return arr
+    out = np.empty((h + ph, w + pw, 4), dtype=np.uint8)
+    out[..., :3] = bg_color[:3]
+    out[..., 3] = 255
+    out[:h, :w] = arr
+    return out
+
+def image_to_glyph_cells(img, mode, bg_color=(0, 0, 0), brightness=1.0, depth=24):
+    """Returns (fg codes, bg codes, pattern) grids for img in mode."""
+    arr = pad_to_cells(image_to_array(img), mode, bg_color)
+    return pixels_to_glyph_cells(blend_pixels(arr, bg_color, brightness), mode, depth)
+
+def pixels_to_glyph_cells(pixels, mode, depth):
+    fg, bg, pattern = fit_cells(pixels, mode)
+    fg_codes = quantize(fg, depth)
+    bg_codes = quantize(bg, depth)
+    # Halves that quantize to one color need no pattern
+    full = (1 << (MODES[mode][0] * MODES[mode][1])) - 1
+    if depth == 1:
+        # Only lit pixels can be drawn: flip patterns whose fg is dark
+        flip = (fg_codes == 0) & (bg_codes == 1)
+        pattern = np.where(flip, full ^ pattern, pattern)
+        fg_codes, bg_codes = np.where(flip, bg_codes, fg_codes), np.where(flip, fg_codes, bg_codes)
+        pattern = np.where(fg_codes == bg_codes, np.where(fg_codes == 1, full, 0), pattern)
+    else:
+        pattern = np.where(fg_codes == bg_codes, 0, pattern)
+    return fg_codes, bg_codes, pattern
+
+def _encode_glyph_line(fg_row, bg_row, pat_row, starts, glyphs, full, swappable, fg, bg) -> str:
+    """
+    Like encode._encode_line for arbitrary cell patterns: tracks fg/bg
+    along the line and emits only changed SGR parameters. Empty patterns
+    are drawn as a space or full block, and (when the mode allows it)
+    patterns may be drawn inverted to reuse the current colors.
+    """
+    out = []
+    cur_fg = cur_bg = None
+    for start, end in zip(starts, starts[1:]):
+        f, b, p = fg_row[start], bg_row[start], pat_row[start]
+        params = []
+        if p == 0 or p == full:
+            c = b if p == 0 else f
+            if cur_bg == c:
+                glyph = " "
+            elif cur_fg == c:
+                glyph = FULL_BLOCK
+            else:
+                params.append(bg[c])
+                cur_bg = c
+                glyph = " "
+        else:
+            if swappable and (cur_fg != f) + (cur_bg != b) > (cur_fg != b) + (cur_bg != f):
+                f, b, p = b, f, full ^ p
+            glyph = glyphs[p]
+            if cur_fg != f:
+                params.append(fg[f])
+                cur_fg = f
+            if cur_bg != b:
+                params.append(bg[b])
+                cur_bg = b
+        if params:
+            out.append(f"\x1b[{';'.join(params)}m")
+        out.append(glyph * (end - start))
+    out.append(RESET)
+    return "".join(out)
+
+def encode_glyph_cells(fg_codes, bg_codes, pattern, mode, depth, optimize=False, stats=None) -> list[str]:
+    """
+    Assembles lines from per-cell fg/bg codes and pattern bits.
+    Depth 1 emits glyphs only; otherwise every line ends in a reset.
+    """
+    glyphs = GLYPHS[mode]
+    full = len(glyphs) - 1
+    if depth == 1:
+        lines = ["".join([glyphs[p] for p in row]) for row in pattern.tolist()]
+    elif optimize:
+        fg, bg = SGR_FG[depth], SGR_BG[depth]
+        rows, w = pattern.shape
+        change = np.ones((rows, w + 1), dtype=bool)
+        change[:, 1:w] = (
+            (fg_codes[:, 1:] != fg_codes[:, :-1])
+            | (bg_codes[:, 1:] != bg_codes[:, :-1])
+            | (pattern[:, 1:] != pattern[:, :-1])
+        )
+        lines = [
+            _encode_glyph_line(f, b, p, np.flatnonzero(c).tolist(), glyphs, full, SWAPPABLE[mode], fg, bg)
+            for f, b, p, c in zip(fg_codes.tolist(), bg_codes.tolist(), pattern.tolist(), change)
+        ]
+    else:
+        fg, bg = SGR_FG[depth], SGR_BG[depth]
+        lines = []
+        for f_row, b_row, p_row in zip(fg_codes.tolist(), bg_codes.tolist(), pattern.tolist()):
+            cells = [f"\x1b[{fg[f]};{bg[b]}m{glyphs[p]}" for f, b, p in zip(f_row, b_row, p_row)]
+            cells.append(RESET)
+            lines.append("".join(cells))
+    count("cells", pattern.size)
+    if stats is not None:
+        stats.cells += pattern.size
+        stats.bytes_out += sum(len(line.encode("utf-8")) for line in lines)
+        stats.bytes_naive += naive_glyph_size(fg_codes, bg_codes, pattern, mode, depth)
+    return lines
+
+def naive_glyph_size(fg_codes, bg_codes, pattern, mode, depth) -> int:
+    """Bytes the unoptimized glyph encoder emits for these cells."""
+    glyph_len = np.array([len(g.encode("utf-8")) for g in GLYPHS[mode]])[pattern]
+    if depth == 1:
+        return int(glyph_len.sum())
+    per_cell = 4 + _params_len(fg_codes, depth, False) + _params_len(bg_codes, depth, True) + glyph_len
+    return int(per_cell.sum()) + 4 * pattern.shape[0]
+
+def encode_glyph_image(img, mode, bg_color=(0, 0, 0), brightness=1.0, depth=24, optimize=False, stats=None) -> list[str]:
+    """Encodes a PIL image with the quadrant, sextant or braille cells of mode."""
+    fg, bg, pattern = image_to_glyph_cells(img, mode, bg_color=bg_color, brightness=brightness, depth=depth)
+    return encode_glyph_cells(fg, bg, pattern, mode, depth, optimize=optimize, stats=stats)
+
+def iter_glyph_bands(img, mode, bg_color=(0, 0, 0), brightness=1.0, depth=24, optimize=False, stats=None, band_rows=16):
+    """Streaming counterpart of encode_glyph_image; see encode.iter_encoded_bands."""
+    arr = image_to_array(img)
+    step = MODES[mode][1] * band_rows
+    for y in range(0, arr.shape[0], step):
+        band = pad_to_cells(arr[y:y + step], mode, bg_color)
+        fg, bg, pattern = pixels_to_glyph_cells(blend_pixels(band, bg_color, brightness), mode, depth)
+        lines = encode_glyph_cells(fg, bg, pattern, mode, depth, optimize=optimize, stats=stats)
+        yield ("\n".join(lines) + "\n").encode("utf-8")
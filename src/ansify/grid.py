@@ -0,0 +1,362 @@
+import re
+
+import numpy as np
+
+from .encode import FULL_BLOCK, LOWER_HALF, MONO_GLYPHS, RESET, UPPER_HALF
+from .palette import ansi256_rgb, quantize
+
+# One terminal cell: its character and fg/bg color codes
+CELL_DTYPE = np.dtype([("glyph", "U1"), ("fg", np.int32), ("bg", np.int32)])
+
+# Color codes: DEFAULT is the terminal's own color, values with the
+# INDEXED bit are palette indices (0-255), anything else is 0xRRGGBB
+DEFAULT = -1
+INDEXED = 1 << 24
+
+# Marks a color an SGR sequence leaves alone
+UNCHANGED = -2
+
+BLANK = np.array((" ", DEFAULT, DEFAULT), dtype=CELL_DTYPE)
+
+# CSI sequences, split into parameters and final byte
+CSI_RE = re.compile(r"\x1b\[([0-?]*)[ -/]*([@-~])")
+# Any other escape sequence, dropped from text
+ESC_RE = re.compile(r"\x1b[@-_]?")
+
+def _sgr(params: str) -> tuple[int, int]:
+    """
+    The (fg, bg) codes set by an SGR parameter string, UNCHANGED where
+    a color is left as is.
+    """
+    fg = bg = UNCHANGED
+    try:
+        codes = list(map(int, params.split(";")))
+    except ValueError:  # Empty or private parameters count as 0
+        codes = [int(p) if p.isdigit() else 0 for p in params.split(";")]
+    n = len(codes)
+    i = 0
+    while i < n:
+        c = codes[i]
+        if c == 0:
+            fg = bg = DEFAULT
+        elif (c == 38 or c == 48) and i + 1 < n:
+            if codes[i + 1] == 2 and i + 4 < n:
+                r, g, b = codes[i + 2:i + 5]
+                value = r << 16 | g << 8 | b if max(r, g, b) <= 255 else UNCHANGED
+                i += 4
+            elif codes[i + 1] == 5 and i + 2 < n:
+                value = INDEXED | codes[i + 2] if codes[i + 2] <= 255 else UNCHANGED
+                i += 2
+            else:
+                break  # Malformed: ignore the rest like terminals do
+            # Out of range colors are ignored, as xterm does
+            if value == UNCHANGED:
+                pass
+            elif c == 38:
+                fg = value
+            else:
+                bg = value
+        elif c == 39:
+            fg = DEFAULT
+        elif c == 49:
+            bg = DEFAULT
+        elif 30 <= c <= 37:
+            fg = INDEXED | (c - 30)
+        elif 90 <= c <= 97:
+            fg = INDEXED | (c - 82)
+        elif 40 <= c <= 47:
+            bg = INDEXED | (c - 40)
+        elif 100 <= c <= 107:
+            bg = INDEXED | (c - 92)
+        i += 1
+    return fg, bg
+
+def _sgr_fields(params: list[str]):
+    """
+    Numeric fields of SGR parameter strings, parsed in bulk from one
+    byte buffer: (values, first field of each string, fields per string,
+    whether each string holds only digits and ';' in fields of at most
+    three digits). Empty fields are 0.
+    """
+    lengths = np.fromiter(map(len, params), dtype=np.int64, count=len(params))
+    b = np.frombuffer(";".join(params).encode("ascii") + b"\0\0\0", dtype=np.uint8)
+    semi = b[:-3] == 0x3B
+    starts = np.cumsum(lengths + 1) - lengths - 1
+    semis = np.concatenate(([0], np.cumsum(semi)))
+    first = semis[starts]
+    counts = semis[starts + lengths] - first + 1
+    field_start = np.flatnonzero(np.concatenate(([True], semi))).astype(np.int32)
+    size = np.append(field_start[1:], len(semi) + 1) - field_start - 1
+    values = np.zeros(len(field_start), dtype=np.int32)
+    for k in range(3):
+        values = np.where(size > k, values * 10 + b[field_start + k] - 0x30, values)
+    clean = np.ones(len(params), dtype=bool)
+    bad = np.flatnonzero((b[:-3] - 0x30 >= 10) & ~semi)
+    clean[np.searchsorted(starts, bad, side="right") - 1] = False
+    clean[np.searchsorted(starts, field_start[size > 3], side="right") - 1] = False
+    return values, first, counts, clean
+
+# SGR effects of the single codes 0..107, UNCHANGED for 108 (and above)
+_PLAIN_FG = np.full(109, UNCHANGED, dtype=np.int64)
+_PLAIN_BG = np.full(109, UNCHANGED, dtype=np.int64)
+_PLAIN_FG[0] = _PLAIN_BG[0] = _PLAIN_FG[39] = _PLAIN_BG[49] = DEFAULT
+_PLAIN_FG[30:38] = INDEXED | np.arange(8)
+_PLAIN_FG[90:98] = INDEXED | np.arange(8, 16)
+_PLAIN_BG[40:48] = INDEXED | np.arange(8)
+_PLAIN_BG[100:108] = INDEXED | np.arange(8, 16)
+
+def _decode_sgrs(params: list[str]) -> np.ndarray:
+    """
+    (len(params), 2) array of _sgr(p) for every parameter string. Runs
+    of plain codes and the fixed-layout 38;5 / 38;2 sequences that
+    encoders emit for nearly every cell are decoded in bulk; anything
+    else goes through _sgr, once per distinct string.
+    """
+    out = np.full((len(params), 2), UNCHANGED, dtype=np.int64)
+    if not params:
+        return out
+    values, first, counts, clean = _sgr_fields(params)
+    has_extended = np.logical_or.reduceat((values == 38) | (values == 48), first)
+    # Plain codes: the last code setting each color wins
+    plain = clean & ~has_extended
+    if plain.any():
+        codes = np.minimum(values[np.repeat(plain, counts)], 108)
+        ends = np.cumsum(counts[plain]) - 1
+        starts = ends - counts[plain] + 1
+        for col, table in ((0, _PLAIN_FG), (1, _PLAIN_BG)):
+            effect = table[codes]
+            last = np.maximum.accumulate(np.where(effect != UNCHANGED, np.arange(len(codes)), -1))[ends]
+            out[plain, col] = np.where(last >= starts, effect[last], UNCHANGED)
+    done = plain.copy()
+    # Field count -> one color or fg plus bg, and 5 (indexed) or 2 (rgb)
+    for n, pair, kind in ((3, False, 5), (6, True, 5), (5, False, 2), (10, True, 2)):
+        seq = np.flatnonzero(clean & has_extended & (counts == n))
+        if not len(seq):
+            continue
+        m = values[first[seq][:, None] + np.arange(n)]
+        width = 1 if kind == 5 else 3
+        if kind == 5:
+            value = lambda col: INDEXED | m[:, col]
+        else:
+            value = lambda col: m[:, col] << 16 | m[:, col + 1] << 8 | m[:, col + 2]
+        # Out of range components go through _sgr, which ignores them
+        in_range = lambda col: (m[:, col:col + width] <= 255).all(axis=1)
+        if pair:
+            half = n // 2
+            ok = (m[:, 0] == 38) & (m[:, 1] == kind) & (m[:, half] == 48) & (m[:, half + 1] == kind)
+            ok &= in_range(2) & in_range(half + 2)
+            fg, bg = value(2), value(half + 2)
+        else:
+            ok = ((m[:, 0] == 38) | (m[:, 0] == 48)) & (m[:, 1] == kind) & in_range(2)
+            fg = np.where(m[:, 0] == 38, value(2), UNCHANGED)
+            bg = np.where(m[:, 0] == 48, value(2), UNCHANGED)
+        out[seq[ok], 0] = fg[ok]
+        out[seq[ok], 1] = bg[ok]
+        done[seq[ok]] = True
+    rest = np.flatnonzero(~done).tolist()
+    if rest:
+        effects = {}
+        for i in rest:
+            p = params[i]
+            if p not in effects:
+                effects[p] = _sgr(p)
+            out[i] = effects[p]
+    return out
+
+def blank_grid(rows: int, cols: int) -> np.ndarray:
+    return np.full((rows, cols), BLANK, dtype=CELL_DTYPE)
+
+def parse_ansi(ansi) -> np.ndarray:
+    """
+    Parses SGR-colored text (a string or a list of lines) into a
+    (rows, cols) CELL_DTYPE array, one cell per character. Colors carry
+    over between lines as in a terminal; short lines are padded with
+    blank cells. Escape sequences other than SGR are skipped.
+    """
+    if not isinstance(ansi, str):
+        ansi = "\n".join(ansi)
+    ansi = ansi.replace("\r", "")
+    # [text, params, final, text, params, final, ..., text]
+    parts = CSI_RE.split(ansi)
+    texts = parts[0::3]
+    params = parts[1::3]
+    # Decode every SGR in bulk, then carry colors forward
+    changes = np.full((len(texts), 2), UNCHANGED, dtype=np.int64)
+    changes[0] = DEFAULT
+    if params:
+        changes[1:] = _decode_sgrs(params)
+        finals = parts[2::3]
+        if finals.count("m") != len(finals):
+            changes[1:][np.array(finals) != "m"] = UNCHANGED
+    last = np.where(changes != UNCHANGED, np.arange(len(texts))[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    state = np.take_along_axis(changes, last, axis=0)
+    if "\x1b" in ansi:
+        texts = [ESC_RE.sub("", t) if "\x1b" in t else t for t in texts]
+    run_len = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    chars = np.frombuffer("".join(texts).encode("utf-32-le"), dtype="<U1")
+    fgs = np.repeat(state[:, 0], run_len)
+    bgs = np.repeat(state[:, 1], run_len)
+    # Place every character by the newlines before it
+    newline = chars == "\n"
+    breaks = np.flatnonzero(newline)
+    row = np.cumsum(newline) - newline
+    col = np.arange(len(chars)) - np.concatenate([[0], breaks + 1])[row]
+    keep = ~newline
+    rows = len(breaks) + (len(chars) > 0 and not newline[-1])
+    cols = int(col[keep].max()) + 1 if keep.any() else 0
+    grid = blank_grid(rows, cols)
+    grid["glyph"][row[keep], col[keep]] = chars[keep]
+    grid["fg"][row[keep], col[keep]] = fgs[keep]
+    grid["bg"][row[keep], col[keep]] = bgs[keep]
+    return grid
+
+def _color_params(code: int, fg: bool) -> str:
+    if code == DEFAULT:
+        return "39" if fg else "49"
+    if code & INDEXED:
+        index = code & 255
+        if index < 8:
+            return f"{(30 if fg else 40) + index}"
+        if index < 16:
+            return f"{(90 if fg else 100) + index - 8}"
+        return f"{38 if fg else 48};5;{index}"
+    return f"{38 if fg else 48};2;{code >> 16};{(code >> 8) & 255};{code & 255}"
+
+_FG = {}
+_BG = {}
+
+def _params(table, code, fg):
+    params = table.get(code)
+    if params is None:
+        params = table[code] = _color_params(code, fg)
+    return params
+
+def encode_grid(grid: np.ndarray) -> list[str]:
+    """
+    Encodes a CELL_DTYPE array back to ANSI lines, emitting SGR
+    parameters only where the color state changes along a line.
+    Every line starts from default colors, and lines that set any color
+    end in a reset.
+    """
+    rows, cols = grid.shape
+    text = np.ascontiguousarray(grid["glyph"]).tobytes().decode("utf-32-le")
+    text = text.replace("\0", " ")
+    fg_codes, bg_codes = grid["fg"], grid["bg"]
+    change = np.ones((rows, cols + 1), dtype=bool)
+    change[:, 1:cols] = (fg_codes[:, 1:] != fg_codes[:, :-1]) | (bg_codes[:, 1:] != bg_codes[:, :-1])
+    lines = []
+    for y, (fg_row, bg_row, row_change) in enumerate(zip(fg_codes.tolist(), bg_codes.tolist(), change)):
+        line = text[y * cols:(y + 1) * cols]
+        starts = np.flatnonzero(row_change).tolist()
+        out = []
+        cur_fg = cur_bg = DEFAULT
+        colored = False
+        for start, end in zip(starts, starts[1:]):
+            f, b = fg_row[start], bg_row[start]
+            params = []
+            if f != cur_fg:
+                params.append(_params(_FG, f, True))
+                cur_fg = f
+            if b != cur_bg:
+                params.append(_params(_BG, b, False))
+                cur_bg = b
+            if params:
+                out.append(f"\x1b[{';'.join(params)}m")
+                colored = True
+            out.append(line[start:end])
+        if colored:
+            out.append(RESET)
+        lines.append("".join(out))
+    return lines
+
+def codes_to_rgb(codes: np.ndarray) -> np.ndarray:
+    """(..., 3) uint8 colors of grid color codes (DEFAULT maps to black)."""
+    palette = ansi256_rgb()
+    packed = np.stack([(codes >> 16) & 255, (codes >> 8) & 255, codes & 255], axis=-1).astype(np.uint8)
+    indexed = palette[codes & 255]
+    rgb = np.where(((codes & INDEXED) != 0)[..., None], indexed, packed)
+    return np.where((codes == DEFAULT)[..., None], 0, rgb).astype(np.uint8)
+
+def requantize(grid: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Maps every color of grid to a color depth (24, 8, 4 or 1) without
+    re-rendering the source. Default colors are kept. At depth 1 colors
+    are dropped and half-block cells become the lit-half glyphs that
+    ansify's monochrome output uses.
+    """
+    out = grid.copy()
+    if depth == 1:
+        glyph = grid["glyph"]
+        is_block = np.isin(glyph, [" ", UPPER_HALF, LOWER_HALF, FULL_BLOCK])
+        fg_lit = np.where(grid["fg"] == DEFAULT, 1, quantize(codes_to_rgb(grid["fg"]), 1))
+        bg_lit = np.where(grid["bg"] == DEFAULT, 0, quantize(codes_to_rgb(grid["bg"]), 1))
+        top = np.where(np.isin(glyph, [UPPER_HALF, FULL_BLOCK]), fg_lit, bg_lit)
+        bottom = np.where(np.isin(glyph, [LOWER_HALF, FULL_BLOCK]), fg_lit, bg_lit)
+        mono = np.array(MONO_GLYPHS)[(top << 1) | bottom]
+        out["glyph"] = np.where(is_block, mono, glyph)
+        out["fg"] = DEFAULT
+        out["bg"] = DEFAULT
+        return out
+    for field in ("fg", "bg"):
+        codes = grid[field]
+        mapped = quantize(codes_to_rgb(codes), depth)
+        if depth != 24:
+            mapped = mapped | INDEXED
+        out[field] = np.where(codes == DEFAULT, DEFAULT, mapped)
+    return out
+
+def _pad(grid: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    if grid.shape == (rows, cols):
+        return grid
+    out = blank_grid(rows, cols)
+    out[:grid.shape[0], :grid.shape[1]] = grid
+    return out
+
+def hstack(grids, gap=0) -> np.ndarray:
+    """Places grids side by side, top-aligned, gap blank columns apart."""
+    rows = max((g.shape[0] for g in grids), default=0)
+    parts = []
+    for i, g in enumerate(grids):
+        if i and gap:
+            parts.append(blank_grid(rows, gap))
+        parts.append(_pad(g, rows, g.shape[1]))
+    return np.concatenate(parts, axis=1) if parts else blank_grid(0, 0)
+
+def vstack(grids, gap=0) -> np.ndarray:
+    """Stacks grids top to bottom, left-aligned, gap blank rows apart."""
+    cols = max((g.shape[1] for g in grids), default=0)
+    parts = []
+    for i, g in enumerate(grids):
+        if i and gap:
+            parts.append(blank_grid(gap, cols))
+        parts.append(_pad(g, g.shape[0], cols))
+    return np.concatenate(parts, axis=0) if parts else blank_grid(0, 0)
+
+def grid_layout(grids, columns: int, gap=0) -> np.ndarray:
+    """Lays grids out row-major, columns per row, in equally sized slots."""
+    if not grids:
+        return blank_grid(0, 0)
+    rows = max(g.shape[0] for g in grids)
+    cols = max(g.shape[1] for g in grids)
+    slots = [_pad(g, rows, cols) for g in grids]
+    lines = [hstack(slots[i:i + columns], gap) for i in range(0, len(slots), columns)]
+    return vstack(lines, gap)
+
+def overlay(base: np.ndarray, top: np.ndarray, x=0, y=0) -> np.ndarray:
+    """
+    Draws top over a copy of base with its corner at column x, row y,
+    clipped to base. Blank cells of top (a space on the default
+    background) are transparent.
+    """
+    out = base.copy()
+    rows, cols = base.shape
+    y0, x0 = max(y, 0), max(x, 0)
+    y1, x1 = min(y + top.shape[0], rows), min(x + top.shape[1], cols)
+    if y0 >= y1 or x0 >= x1:
+        return out
+    src = top[y0 - y:y1 - y, x0 - x:x1 - x]
+    opaque = (src["glyph"] != " ") | (src["bg"] != DEFAULT)
+    region = out[y0:y1, x0:x1]
+    region[opaque] = src[opaque]
+    return out
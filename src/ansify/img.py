@@ -1,97 +1,141 @@
+import io
 import numpy as np
 
 from PIL import Image
 
 from .term import get_terminal_color_depth
+from .encode import encode_image, image_to_cells, iter_encoded_bands
+# Re-exported: rgb_to_ansi256 lived here before palette.py
+from .palette import rgb_to_ansi256  # noqa: F401
+from .cache import cached_bytes
+from .comp import pad_line, visible_width
+from .dither import DITHER_METHODS
+from .glyphs import MODES, encode_glyph_image, iter_glyph_bands
+from .instrument import count, stage, timed_iter
+
+# Let resize() shrink by whole factors first (Image.reduce) while staying
+# at least this many times the target size, which keeps LANCZOS quality
+REDUCING_GAP = 3.0
+
+def target_size(size, max_height, mode="half"):
+    """
+    Pixel size an image of size is resized to for rendering in mode:
+    max_height half-block rows, with denser modes getting proportionally
+    more pixels per cell. Never scales up.
+    """
+    w, h = size
+    if mode == "half":
+        if h <= max_height:
+            return size
+        scale = max_height / h
+        return (max(1, int(w * scale)), max(1, int(h * scale)))
+    cw, ch = MODES[mode]
+    scale = min(1.0, max_height / h)
+    return (max(1, round(w * scale * cw)), max(1, round(h * scale * ch / 2)))
 
 def resize_image(img, max_height):
-    w, h = img.size
-    if h <= max_height:
-        return img  # No resize needed
-    scale = max_height / h
-    new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
-    return img.resize(new_size, Image.LANCZOS)  # LANCZOS = high-quality downsampling
-
-def rgb_to_ansi256(r, g, b):
-    # Standard xterm 256-color approximation (see: https://stackoverflow.com/a/33206814)
-    # Grayscale range
-    if r == g == b:
-        if r < 8: return 16
-        if r > 248: return 231
-        return round(((r - 8) / 247) * 24) + 232
-    # Color cube
-    r_val = int(round(r / 255 * 5))
-    g_val = int(round(g / 255 * 5))
-    b_val = int(round(b / 255 * 5))
-    return 16 + 36 * r_val + 6 * g_val + b_val
+    return resize_for_mode(img, max_height)
+
+def resize_for_mode(img, max_height, mode="half"):
+    """
+    Resizes img so that rendering it in mode covers the same terminal
+    cells as a half-block render of resize_image(img, max_height), giving
+    denser modes more source pixels per cell.
+    """
+    new_size = target_size(img.size, max_height, mode)
+    if new_size == img.size:
+        return img
+    return img.resize(new_size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def reduce_on_load(img, size):
+    """
+    Asks the decoder of an unloaded img to decode at a reduced scale that
+    is still at least size (JPEG DCT scaling); a no-op for other formats.
+    """
+    img.draft(img.mode, size)
+    return img
+
+def resizable(img):
+    """
+    img converted to RGB, or RGBA if it has transparency, so that resizing
+    filters it (PIL resizes palette and bilevel images with NEAREST).
+    """
+    if img.mode in ("RGB", "RGBA"):
+        return img
+    if "A" in img.getbands() or "transparency" in img.info:
+        return img.convert("RGBA")
+    return img.convert("RGB")
 
 def image_to_ansi8(img, bg_color, brightness) -> list[str]:
-    img = img.convert("RGBA")
-    w, h = img.size
-    lines = []
-    for y in range(0, h, 2):
-        line = ""
-        for x in range(w):
-            def blend(px):
-                r, g, b, a = px
-                r_out = min(int((r * a + bg_color[0] * (255 - a)) / 255 * brightness), 255)
-                g_out = min(int((g * a + bg_color[1] * (255 - a)) / 255 * brightness), 255)
-                b_out = min(int((b * a + bg_color[2] * (255 - a)) / 255 * brightness), 255)
-                return (r_out, g_out, b_out)
-            top = img.getpixel((x, y))
-            bot = img.getpixel((x, y+1)) if y+1 < h else (bg_color[0], bg_color[1], bg_color[2], 255)
-            fg = blend(top)
-            bg = blend(bot)
-            fg_ansi = rgb_to_ansi256(*fg)
-            bg_ansi = rgb_to_ansi256(*bg)
-            line += f"\x1b[38;5;{fg_ansi};48;5;{bg_ansi}m▀"
-        line += "\x1b[0m"
-        lines.append(line)
-    return lines
+    return encode_image(img, bg_color=bg_color, brightness=brightness, depth=8)
 
 def image_to_ansi24(img, bg_color, brightness) -> list[str]:
-    # Assume input is RGBA or RGB
-    img = img.convert("RGBA")
-    w, h = img.size
-    lines = []
-    for y in range(0, h, 2):
-        line = ""
-        for x in range(w):
-            def blend(px):
-                r, g, b, a = px
-                # Premultiply with alpha over bg_color
-                r_out = min(int((r * a + bg_color[0] * (255 - a)) / 255 * brightness), 255)
-                g_out = min(int((g * a + bg_color[1] * (255 - a)) / 255 * brightness), 255)
-                b_out = min(int((b * a + bg_color[2] * (255 - a)) / 255 * brightness), 255)
-                return (r_out, g_out, b_out)
-
-            top = img.getpixel((x, y))
-            bot = img.getpixel((x, y+1)) if y+1 < h else (bg_color[0], bg_color[1], bg_color[2], 255)
-            fg = blend(top)
-            bg = blend(bot)
-            line += f"\x1b[38;2;{fg[0]};{fg[1]};{fg[2]};48;2;{bg[0]};{bg[1]};{bg[2]}m▀"
-        line += "\x1b[0m"
-        lines.append(line)
-    return lines
-
-def img_to_ansi(img, bg_color=(0, 0, 0), brightness=1.0):
+    return encode_image(img, bg_color=bg_color, brightness=brightness, depth=24)
+
+def img_to_ansi(img, bg_color=(0, 0, 0), brightness=1.0, depth=None, optimize=True, stats=None, mode="half", dither=None):
     """
     Converts an image to ANSI escape codes.
     img: PIL.Image object.
     bg_color: (R,G,B) tuple for the background color.
     brightness: float, scaling factor for brightness.
+    depth: color depth in bits (24, 8, 4 or 1); defaults to the terminal's.
+    optimize: only emit SGR parameters that change along a line.
+    stats: optional encode.EncodeStats collecting output sizes.
+    mode: cell encoding, one of glyphs.MODES ("half", "quadrant",
+    "sextant", "braille"); each image pixel maps to one cell sub-pixel.
+    dither: None or one of dither.DITHER_METHODS, applied to the pixels
+    before palette lookup at depths 8, 4 and 1 (half mode only).
     Returns a list of strings representing the ANSI image.
     """
-    bits = get_terminal_color_depth()
+    bits = resolve_depth(depth)
+    resolve_mode(mode)
+    resolve_dither(dither, mode)
 
     if img.mode not in ("RGBA", "RGB"):
         img = img.convert("RGBA")
-    if bits == 8:
-        return image_to_ansi8(img, bg_color, brightness)
-    elif bits == 24:
-        return image_to_ansi24(img, bg_color, brightness)
+    with stage("encode"):
+        if mode != "half":
+            return encode_glyph_image(img, mode, bg_color=bg_color, brightness=brightness, depth=bits, optimize=optimize, stats=stats)
+        return encode_image(img, bg_color=bg_color, brightness=brightness, depth=bits, optimize=optimize, stats=stats, dither=dither)
+
+def iter_ansi_rows(img, bg_color=(0, 0, 0), brightness=1.0, depth=None, optimize=True, stats=None, band_rows=16, mode="half", dither=None):
+    """
+    Streaming variant of img_to_ansi.
+    Yields bytes holding band_rows newline-terminated ANSI lines at a time.
+    """
+    bits = resolve_depth(depth)
+    resolve_dither(dither, mode)
+    if resolve_mode(mode) != "half":
+        bands = iter_glyph_bands(
+            img, mode, bg_color=bg_color, brightness=brightness, depth=bits,
+            optimize=optimize, stats=stats, band_rows=band_rows
+        )
     else:
-        raise ValueError(f"Unsupported color depth: {bits}. Use 8 or 24 bits.")
+        bands = iter_encoded_bands(
+            img, bg_color=bg_color, brightness=brightness, depth=bits,
+            optimize=optimize, stats=stats, band_rows=band_rows, dither=dither
+        )
+    return timed_iter("encode", bands)
+
+def resolve_depth(depth):
+    bits = depth if depth is not None else get_terminal_color_depth()
+    if bits not in (24, 8, 4, 1):
+        raise ValueError(f"Unsupported color depth: {bits}. Use 1, 4, 8 or 24 bits.")
+    return bits
+
+def resolve_mode(mode):
+    if mode not in MODES:
+        raise ValueError(f"Unsupported mode: {mode}. Use one of {', '.join(MODES)}.")
+    return mode
+
+def resolve_dither(dither, mode="half"):
+    if dither is None:
+        return None
+    if dither not in DITHER_METHODS:
+        raise ValueError(f"Unknown dither method: {dither}. Use one of {', '.join(DITHER_METHODS)}.")
+    if mode != "half":
+        raise ValueError(f"Dithering is only available in half mode, not {mode}")
+    return dither
 
 def crop_image(img, crop_top=0, crop_right=0, crop_bottom=0, crop_left=0):
     """
@@ -140,16 +184,19 @@ def pad_lines(lines, target_len):
 def join_ansi_images_side_by_side(ansi_img1, ansi_img2, sep=""):
     """
     Joins two ANSI images side by side, line by line.
-    Inputs can be lists of strings or multi-line strings.
+    Inputs can be lists of strings or multi-line strings. Lines of the
+    left image are padded to its visible width so ragged or shorter
+    images keep the right one aligned.
     """
     lines1 = split_lines(ansi_img1)
     lines2 = split_lines(ansi_img2)
     max_lines = max(len(lines1), len(lines2))
     lines1 = pad_lines(lines1, max_lines)
     lines2 = pad_lines(lines2, max_lines)
+    width = max(map(visible_width, lines1), default=0)
     # Optionally, add separator (e.g., sep="  ") between images
     joined = [
-        f"{l1}{sep}{l2}" for l1, l2 in zip(lines1, lines2)
+        f"{pad_line(l1, width)}{sep}{l2}" for l1, l2 in zip(lines1, lines2)
     ]
     return "\n".join(joined)
 
@@ -159,6 +206,8 @@ def composite_background(img, bg_color):
     bg_color: (R,G,B) tuple.
     Returns: RGB PIL.Image
     """
+    if img.mode == "RGB":
+        return img
     if img.mode != "RGBA":
         img = img.convert("RGBA")
     arr = np.array(img).astype(np.float32)
@@ -175,15 +224,142 @@ class AnsiImageRenderer:
     """
     Class to render ANSI images.
     This class can be extended to add more rendering features.
+    padding/crop: (top, right, bottom, left) pixels applied after resizing.
+    cache: optional cache.RenderCache for finished renders.
+    dither: None or one of dither.DITHER_METHODS (see img_to_ansi).
+    max_bytes: optional output size budget (half mode). Height, depth (up
+    to depth) and color precision are then chosen to fit it; see
+    budget.fit_budget. The last choice is kept in budget_choice.
     """
-    def __init__(self, max_width, max_height, bg_color, brightness):
+    def __init__(self, max_width, max_height, bg_color, brightness, padding=(0, 0, 0, 0), crop=(0, 0, 0, 0), depth=None, optimize=True, cache=None, mode="half", dither=None, max_bytes=None):
         self.max_width = max_width
         self.max_height = max_height
         self.bg_color = bg_color
         self.brightness = brightness
+        self.padding = padding
+        self.crop = crop
+        self.depth = depth
+        self.optimize = optimize
+        self.cache = cache
+        self.mode = mode
+        self.dither = dither
+        self.max_bytes = max_bytes
+        self.budget_choice = None
+
+    def params(self) -> dict:
+        """Every setting that affects the output, for cache keys."""
+        return dict(
+            max_width=self.max_width, max_height=self.max_height,
+            bg_color=tuple(self.bg_color), brightness=self.brightness,
+            padding=tuple(self.padding), crop=tuple(self.crop),
+            depth=resolve_depth(self.depth), optimize=self.optimize, mode=self.mode, dither=self.dither,
+            max_bytes=self.max_bytes,
+        )
+
+    def target_size(self, size) -> tuple[int, int]:
+        """Size an image of size is resized to before crop and padding."""
+        return target_size(size, self.max_height, self.mode)
+
+    def prepare(self, img: Image.Image) -> Image.Image:
+        """
+        Resizes, composites, crops and pads img ready for encoding.
+        Resizing comes first (PIL filters RGBA with premultiplied alpha)
+        so that everything after it works at the output resolution.
+        """
+        count("pixels_in", img.width * img.height)
+        img = self._frame(self._scale(img))
+        count("pixels_encoded", img.width * img.height)
+        return img
 
-    def render(self, img: Image.Image) -> str:
-        img = composite_background(img, bg_color=self.bg_color)
-        img = resize_image(img, max_height=self.max_height)
-        ansi_art = img_to_ansi(img, bg_color=self.bg_color, brightness=self.brightness)
+    def _scale(self, img):
+        with stage("resize"):
+            img = resize_for_mode(resizable(img), self.max_height, self.mode)
+        with stage("composite"):
+            return composite_background(img, bg_color=self.bg_color)
+
+    def _frame(self, img):
+        if any(self.crop):
+            with stage("crop"):
+                img = crop_image(img, *self.crop)
+        if any(self.padding):
+            with stage("pad"):
+                img = pad_image(img, *self.padding, bg_color=self.bg_color)
+        return img
+
+    def render(self, img: Image.Image, stats=None) -> list[str]:
+        if self.cache is not None:
+            key = self.cache.key("img-pixels", img.tobytes(), image_mode=img.mode, size=img.size, **self.params())
+            data = cached_bytes(self.cache, key, lambda: "\n".join(self._render(img, stats=stats)).encode("utf-8"), stats=stats)
+            return data.decode("utf-8").split("\n") if data else []
+        return self._render(img, stats=stats)
+
+    def _render(self, img, stats=None):
+        if self.max_bytes is not None:
+            return self._fit_budget(img, stats=stats)
+        img = self.prepare(img)
+        ansi_art = img_to_ansi(img, bg_color=self.bg_color, brightness=self.brightness, depth=self.depth, optimize=self.optimize, stats=stats, mode=self.mode, dither=self.dither)
         return ansi_art
+
+    def iter_rows(self, img: Image.Image, stats=None):
+        """Streams the rendered image as bytes; see iter_ansi_rows."""
+        if self.max_bytes is not None:
+            lines = self._fit_budget(img, stats=stats)
+            return iter([("\n".join(lines) + "\n").encode("utf-8")])
+        img = self.prepare(img)
+        return iter_ansi_rows(img, bg_color=self.bg_color, brightness=self.brightness, depth=self.depth, optimize=self.optimize, stats=stats, mode=self.mode, dither=self.dither)
+
+    def _fit_budget(self, img, stats=None):
+        from .budget import fit_budget
+        if self.mode != "half":
+            raise ValueError(f"A byte budget is only available in half mode, not {self.mode}")
+        resolve_dither(self.dither)
+        count("pixels_in", img.width * img.height)
+        self.budget_choice, lines = fit_budget(
+            self._scale(img), self.max_bytes, self._frame, self.max_height, resolve_depth(self.depth),
+            bg_color=self.bg_color, brightness=self.brightness, dither=self.dither, stats=stats,
+        )
+        return lines
+
+    def open(self, source) -> Image.Image:
+        """
+        Decodes the image file source (a path or binary file object),
+        reduced on load to no less than what prepare() will need.
+        """
+        img = Image.open(source)
+        reduce_on_load(img, self.target_size(img.size))
+        with stage("decode"):
+            img.load()
+        return img
+
+    def iter_file(self, path, stats=None):
+        """
+        Streams the rendered image file at path (a path or binary file
+        object). With a cache, the key is the file's bytes plus params(),
+        and hits skip decoding entirely.
+        """
+        if self.cache is None:
+            with self.open(path) as img:
+                yield from self.iter_rows(img, stats=stats)
+            return
+        with stage("read"):
+            if hasattr(path, "read"):
+                data = path.read()
+            else:
+                with open(path, "rb") as f:
+                    data = f.read()
+        key = self.cache.key("img", data, **self.params())
+        hit = self.cache.get(key)
+        if hit is not None:
+            if stats is not None:
+                stats.add_cached(hit)
+            yield hit
+            return
+        with self.open(io.BytesIO(data)) as img:
+            yield from self.cache.tee(key, self.iter_rows(img, stats=stats))
+
+    def cells(self, img: Image.Image) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the top/bottom color code grids for a half-block render."""
+        if self.mode != "half":
+            raise ValueError(f"Cell grids are only available in half mode, not {self.mode}")
+        img = self.prepare(img)
+        return image_to_cells(img, bg_color=self.bg_color, brightness=self.brightness, depth=resolve_depth(self.depth), dither=self.dither)
@@ -0,0 +1,113 @@
+import json
+import time
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# The Profile collecting stage timings for the current context, if any
+_current = ContextVar("ansify_profile", default=None)
+
+_DISABLED = nullcontext()
+
+class Profile:
+    """
+    Stage timings and counters for one run.
+    on_stage(name, seconds) is called as each stage finishes, for callers
+    that want to forward timings elsewhere as they happen.
+    """
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.elapsed = None
+
+    def add(self, name: str, seconds: float):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {"seconds": 0.0, "calls": 0}
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        if self.on_stage is not None:
+            self.on_stage(name, seconds)
+
+    def count(self, name: str, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start
+        return {"total_seconds": elapsed, "stages": self.stages, "counters": self.counters}
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+class _Stage:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+        return False
+
+@contextmanager
+def profiling(profile=None, on_stage=None):
+    """
+    Collects stage timings and counters from every ansify call made in
+    the block (and in tasks or threads started from its context):
+
+        with profiling() as profile:
+            AnsiImageRenderer(...).render(img)
+        print(profile.to_json())
+    """
+    if profile is None:
+        profile = Profile(on_stage=on_stage)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        profile.elapsed = time.perf_counter() - profile.start
+
+def stage(name: str):
+    """Context manager timing a stage; a shared no-op when not profiling."""
+    profile = _current.get()
+    if profile is None:
+        return _DISABLED
+    return _Stage(profile, name)
+
+def count(name: str, n=1):
+    profile = _current.get()
+    if profile is not None:
+        profile.count(name, n)
+
+def timed_iter(name: str, iterable):
+    """
+    Yields from iterable, charging the time spent producing each item to
+    stage name. Returns iterable untouched when not profiling.
+    """
+    profile = _current.get()
+    if profile is None:
+        return iterable
+    return _timed_iter(profile, name, iter(iterable))
+
+def _timed_iter(profile, name, it):
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                total += time.perf_counter() - start
+                return
+            total += time.perf_counter() - start
+            yield item
+    finally:
+        profile.add(name, total)
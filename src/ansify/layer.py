@@ -1,12 +1,16 @@
-from matplotlib.font_manager import findfont, FontProperties
+import math
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
 from .img import img_to_ansi, resize_image
 
+FILTERS = ("nearest", "bilinear", "trilinear")
+
 class Layer:
     def __init__(self):
         self._transform = np.eye(3)
+        self.version = 0
 
     def set_transform(self, matrix):
         m = np.asarray(matrix)
@@ -16,72 +20,379 @@ class Layer:
             self._transform = m
         else:
             raise ValueError("Transform must be 2x3 or 3x3 matrix.")
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """Flag the layer as changed so the Compositor re-renders it."""
+        self.version += 1
 
-    def render_layer(self, arr):
+    def footprint(self, width, height):
+        """
+        Pixel bounding box (x0, y0, x1, y1) this layer can draw into on a
+        width x height canvas, or None if it draws nothing. Defaults to the
+        whole canvas; subclasses with bounded content should narrow it.
+        """
+        return (0, 0, width, height)
+
+    def render_layer(self, arr, region=None):
         h, w, _ = arr.shape
-        ys, xs = np.meshgrid(np.arange(h), np.arange(w), indexing='ij')
-        us = (xs + 0.5) / w
-        vs = (ys + 0.5) / h
-        ones = np.ones_like(us)
-        uv1 = np.stack([us, vs, ones], axis=-1)
-        inv = np.linalg.inv(self._transform)
-        mapped = uv1 @ inv.T
-        mapped_u = mapped[..., 0]
-        mapped_v = mapped[..., 1]
+        uv1 = _uv_grid(h, w)
+        if region is not None:
+            x0, y0, x1, y1 = region
+            uv1 = uv1[y0:y1, x0:x1]
+            arr = arr[y0:y1, x0:x1]
+        if np.array_equal(self._transform, np.eye(3)):
+            mapped_u, mapped_v = uv1[..., 0], uv1[..., 1]
+        else:
+            inv = np.linalg.inv(self._transform)
+            mapped = uv1 @ inv.T
+            mapped_u = mapped[..., 0]
+            mapped_v = mapped[..., 1]
         # Instead of discarding, pass to self.sample:
         self.render_uv(arr, mapped_u, mapped_v)
 
     def render_uv(self, arr, u, v):
-        # By default, call sample per-pixel (slow, but always correct).
-        h, w, _ = arr.shape
-        for y in range(h):
-            for x in range(w):
-                arr[y, x] = self.sample(u[y, x], v[y, x], arr)
-        # Subclasses can override render_uv for vectorized/fast implementations.
+        arr[...] = self.sample_uv(u, v)
+
+    def sample_uv(self, u, v):
+        """
+        Batched sampling contract: u, v are (H, W) float arrays of normalized
+        coordinates; returns an (H, W, 4) uint8 RGBA array (or anything that
+        broadcasts to it). Subclasses should override this.
+        """
+        # Compatibility shim for layers that only implement per-pixel sample().
+        out = np.empty(u.shape + (4,), dtype=np.uint8)
+        for y, x in np.ndindex(u.shape):
+            out[y, x] = self.sample(u[y, x], v[y, x], out)
+        return out
 
     def sample(self, u, v, arr):
-        """Subclasses MUST override: sample at normalized (u, v) in [0,1]."""
+        """Per-pixel fallback: sample at normalized (u, v) in [0,1]."""
         raise NotImplementedError
 
+@lru_cache(maxsize=8)
+def _uv_grid(h, w):
+    """Read-only (H, W, 3) grid of pixel-center (u, v, 1) coordinates."""
+    ys, xs = np.meshgrid(np.arange(h), np.arange(w), indexing='ij')
+    us = (xs + 0.5) / w
+    vs = (ys + 0.5) / h
+    uv1 = np.stack([us, vs, np.ones_like(us)], axis=-1)
+    uv1.flags.writeable = False
+    return uv1
+
 class BackgroundLayer(Layer):
     def __init__(self, color=(0,0,0,255)):
         super().__init__()
         self.color = np.array(color, dtype=np.uint8)
+    def sample_uv(self, u, v):
+        return self.color
     def sample(self, u, v, arr):
         return self.color
 
 class ImageLayer(Layer):
-    def __init__(self, img):
+    """
+    A layer drawing an image over the unit square. The image is stored as
+    a mip pyramid of premultiplied RGBA levels, each half the size of the
+    one below, built once here. Renders sample the level matching the
+    transform's scale, so shrunk and rotated images do not alias and reads
+    stay within an array about the size of the output.
+
+    filter is "nearest" or "bilinear" (the closest level) or "trilinear"
+    (bilinear on the two closest levels, blended).
+    """
+    def __init__(self, img, filter="trilinear"):
         super().__init__()
+        if filter not in FILTERS:
+            raise ValueError(f"Unknown filter: {filter}. Use one of {', '.join(FILTERS)}.")
         self.img = np.array(img.convert("RGBA"))
         self.h, self.w = self.img.shape[:2]
-    def render_uv(self, arr, u, v):
-        # u, v are arrays of shape (H, W) with floats in [0, 1]
-        iy = np.clip((v * self.h).astype(int), 0, self.h - 1)
-        ix = np.clip((u * self.w).astype(int), 0, self.w - 1)
-        arr[:] = self.img[iy, ix]
+        self.filter = filter
+        self.levels = _mip_levels(self.img)
+        self.lod = 0.0
+    def footprint(self, width, height):
+        # The transformed unit square, in canvas pixels
+        corners = self._transform @ np.array([[0, 1, 0, 1], [0, 0, 1, 1], [1, 1, 1, 1]], dtype=float)
+        xs = corners[0] / corners[2] * width
+        ys = corners[1] / corners[2] * height
+        x0 = max(int(np.floor(xs.min())) - 1, 0)
+        y0 = max(int(np.floor(ys.min())) - 1, 0)
+        x1 = min(int(np.ceil(xs.max())) + 1, width)
+        y1 = min(int(np.ceil(ys.max())) + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+    def level_of_detail(self, width, height):
+        """
+        log2 of the image pixels covered per canvas pixel on a width x
+        height canvas, from the linear part of the transform; 0 when the
+        image is drawn at or above its own resolution.
+        """
+        inv = np.linalg.inv(self._transform)
+        dx = math.hypot(inv[0, 0] * self.w, inv[1, 0] * self.h) / width
+        dy = math.hypot(inv[0, 1] * self.w, inv[1, 1] * self.h) / height
+        return max(0.0, math.log2(max(dx, dy, 1e-12)))
+    def render_layer(self, arr, region=None):
+        # The level depends on the canvas size, which sample_uv never sees
+        self.lod = self.level_of_detail(arr.shape[1], arr.shape[0])
+        super().render_layer(arr, region)
+    def sample_uv(self, u, v):
+        # u, v are arrays of shape (H, W); outside [0, 1] is transparent
+        top = len(self.levels) - 1
+        if self.filter == "trilinear":
+            level = min(int(self.lod), top)
+            frac = min(self.lod - level, 1.0) if level < top else 0.0
+            acc = _bilinear(self.levels[level], u, v)
+            if frac > 0:
+                acc *= 1 - frac
+                acc += _bilinear(self.levels[level + 1], u, v) * np.float32(frac)
+        else:
+            level = min(int(self.lod + 0.5), top)
+            if self.filter == "bilinear":
+                acc = _bilinear(self.levels[level], u, v)
+            else:
+                acc = _nearest(self.levels[level], u, v)
+        out = _straight(acc)
+        out[(u < 0) | (u >= 1) | (v < 0) | (v >= 1)] = 0
+        return out
+
+def _mip_levels(img):
+    """Premultiplied (H, W, 4) uint8 levels of img, halving down to 1x1."""
+    level = img
+    if img[..., 3].min() < 255:
+        alpha = img[..., 3:4]
+        acc = np.multiply(img, alpha, dtype=np.uint16)
+        np.multiply(alpha, 255, out=acc[..., 3:4], dtype=np.uint16)
+        _div255(acc, np.empty_like(acc))
+        level = acc.astype(np.uint8)
+    levels = [level]
+    while max(level.shape[:2]) > 1:
+        h, w = level.shape[:2]
+        # Odd sizes repeat their last row or column
+        if h % 2 or w % 2:
+            level = np.pad(level, ((0, h % 2), (0, w % 2), (0, 0)), mode="edge")
+        acc = level[0::2].astype(np.uint16)
+        acc += level[1::2]
+        acc = acc[:, 0::2] + acc[:, 1::2]
+        acc += 2
+        acc >>= 2
+        level = acc.astype(np.uint8)
+        levels.append(level)
+    return levels
+
+def _texels(level, index):
+    """float32 (..., 4) texels of level at flat pixel index, one gather each."""
+    h, w = level.shape[:2]
+    flat = level.view(np.uint32).reshape(h * w)
+    return flat[index].view(np.uint8).reshape(index.shape + (4,)).astype(np.float32)
+
+def _nearest(level, u, v):
+    h, w = level.shape[:2]
+    iy = np.clip((v * h).astype(np.intp), 0, h - 1)
+    ix = np.clip((u * w).astype(np.intp), 0, w - 1)
+    return _texels(level, iy * w + ix)
+
+def _bilinear(level, u, v):
+    """
+    float32 (H, W, 4) bilinear samples of level at u, v, clamped to its
+    edges: four texel gathers, blended by the fractional position.
+    """
+    h, w = level.shape[:2]
+    s = u.astype(np.float32) * w - 0.5
+    t = v.astype(np.float32) * h - 0.5
+    x0 = np.floor(s)
+    y0 = np.floor(t)
+    fx = (s - x0)[..., None]
+    fy = (t - y0)[..., None]
+    x0 = x0.astype(np.intp)
+    y0 = y0.astype(np.intp)
+    xa = np.clip(x0, 0, w - 1)
+    xb = np.clip(x0 + 1, 0, w - 1)
+    ya = np.clip(y0, 0, h - 1) * w
+    yb = np.clip(y0 + 1, 0, h - 1) * w
+    top = _texels(level, ya + xa)
+    top += (_texels(level, ya + xb) - top) * fx
+    bottom = _texels(level, yb + xa)
+    bottom += (_texels(level, yb + xb) - bottom) * fx
+    top += (bottom - top) * fy
+    return top
+
+def _straight(acc):
+    """Straight-alpha uint8 RGBA from premultiplied float32 samples."""
+    alpha = acc[..., 3:4]
+    scale = np.divide(255, alpha, out=np.zeros_like(alpha), where=alpha >= 0.5)
+    acc[..., :3] *= scale
+    np.minimum(acc, 255, out=acc)
+    acc += 0.5
+    return acc.astype(np.uint8)
+
+def _div255(acc, scratch):
+    """In-place rounded division by 255 of uint16 values up to 65025."""
+    acc += 128
+    np.right_shift(acc, 8, out=scratch)
+    acc += scratch
+    acc >>= 8
+
+def _unpremultiply(acc):
+    """Straight-alpha uint8 RGBA from a premultiplied uint16 buffer."""
+    out = np.empty(acc.shape, dtype=np.uint8)
+    alpha = acc[..., 3:4].astype(np.uint32)
+    safe = np.maximum(alpha, 1)
+    rgb = (acc[..., :3] * np.uint32(255) + safe // 2) // safe
+    out[..., :3] = np.where(alpha > 0, np.minimum(rgb, 255), 0)
+    out[..., 3] = acc[..., 3]
+    return out
 
 class Compositor:
-    def __init__(self, width, height, layers):
+    """
+    Composites layers bottom to top with the "over" operator.
+    Blending runs on premultiplied alpha in uint16 fixed point, accumulating
+    in place into buffers that are allocated once per canvas size.
+
+    Renders are incremental: layers whose version changed since the last
+    render are "dirty". The composite of the static layers below the dirty
+    range and the rendered pixels of each static layer above it are cached,
+    and only the tile_size tiles touched by the dirty layers' old and new
+    footprints are recomputed. Layers above are blended one at a time, as
+    in a full render, so the result never depends on render history.
+    last_tiles_recomputed / tiles_total report the work done per frame.
+    """
+    def __init__(self, width, height, layers, tile_size=16):
         self.width = width
         self.height = height
         self.layers = layers
+        self.tile_size = tile_size
+        self.last_tiles_recomputed = 0
+        self._shape = None
+        self._state = None
+
+    @property
+    def tiles_total(self):
+        t = self.tile_size
+        return -(-self.width // t) * -(-self.height // t)
+
+    def _buffers(self):
+        shape = (self.height, self.width)
+        if self._shape != shape:
+            self._layer = np.zeros(shape + (4,), dtype=np.uint8)
+            self._src = np.zeros(shape + (4,), dtype=np.uint16)
+            self._inv = np.zeros(shape + (1,), dtype=np.uint16)
+            self._below = np.zeros(shape + (4,), dtype=np.uint16)
+            self._above = []
+            self._frame = np.zeros(shape + (4,), dtype=np.uint16)
+            self._shape = shape
+            self._state = None
+
+    @staticmethod
+    def _premultiply(layer, src, inv):
+        """src = layer premultiplied and scaled by 255, inv = 255 - alpha."""
+        alpha = layer[..., 3:4]
+        np.subtract(255, alpha, out=inv, dtype=np.uint16)
+        np.multiply(layer, alpha, out=src, dtype=np.uint16)
+        np.multiply(alpha, 255, out=src[..., 3:4], dtype=np.uint16)
+
+    def _blend(self, acc, layer, src, inv):
+        """acc = layer over acc, all premultiplied (acc) or straight (layer)."""
+        self._premultiply(layer, src, inv)
+        acc *= inv
+        acc += src
+        _div255(acc, src)
+
+    def _composite(self, acc, layers, region):
+        """Composites layers over acc within region (x0, y0, x1, y1)."""
+        x0, y0, x1, y1 = region
+        window = (slice(y0, y1), slice(x0, x1))
+        for l in layers:
+            l.render_layer(self._layer, region)
+            self._blend(acc[window], self._layer[window], self._src[window], self._inv[window])
+
+    def _rebuild(self, lo, hi):
+        """Re-caches the static groups around layers[lo:hi] and redraws everything."""
+        full = (0, 0, self.width, self.height)
+        self._below.fill(0)
+        self._composite(self._below, self.layers[:lo], full)
+        self._above = []
+        for l in self.layers[hi:]:
+            box = l.footprint(self.width, self.height)
+            if box is not None:
+                # Kept as _blend's premultiplied src and 255 - alpha
+                x0, y0, x1, y1 = box
+                window = (slice(y0, y1), slice(x0, x1))
+                l.render_layer(self._layer, box)
+                layer = self._layer[window]
+                src = np.empty(layer.shape, dtype=np.uint16)
+                inv = np.empty(layer.shape[:2] + (1,), dtype=np.uint16)
+                self._premultiply(layer, src, inv)
+                self._above.append((box, src, inv))
+        self._redraw(lo, hi, full)
+        self.last_tiles_recomputed = self.tiles_total
+
+    def _redraw(self, lo, hi, region):
+        x0, y0, x1, y1 = region
+        window = (slice(y0, y1), slice(x0, x1))
+        frame = self._frame
+        frame[window] = self._below[window]
+        self._composite(frame, self.layers[lo:hi], region)
+        # Transparent pixels leave the frame as is, so blending is limited
+        # to where each layer above draws
+        for (bx0, by0, bx1, by1), src, inv in self._above:
+            cx0, cy0, cx1, cy1 = max(x0, bx0), max(y0, by0), min(x1, bx1), min(y1, by1)
+            if cx0 < cx1 and cy0 < cy1:
+                acc = frame[cy0:cy1, cx0:cx1]
+                clip = (slice(cy0 - by0, cy1 - by0), slice(cx0 - bx0, cx1 - bx0))
+                acc *= inv[clip]
+                acc += src[clip]
+                _div255(acc, self._src[cy0:cy1, cx0:cx1])
+
+    def _dirty_regions(self, footprints):
+        """Merges the tiles touched by footprints into row-wise rectangles."""
+        t = self.tile_size
+        tiles = np.zeros((-(-self.height // t), -(-self.width // t)), dtype=bool)
+        for box in footprints:
+            if box is not None:
+                x0, y0, x1, y1 = box
+                tiles[y0 // t:-(-y1 // t), x0 // t:-(-x1 // t)] = True
+        regions = []
+        for ty, row in enumerate(tiles):
+            edges = np.diff(row.astype(np.int8), prepend=0, append=0)
+            for tx0, tx1 in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+                regions.append((
+                    int(tx0) * t, ty * t,
+                    min(int(tx1) * t, self.width), min((ty + 1) * t, self.height),
+                ))
+        return regions, int(tiles.sum())
 
     def render(self):
-        arr = np.zeros((self.height, self.width, 4), dtype=np.uint8)
-        for layer in self.layers:
-            tmp = np.zeros_like(arr)
-            layer.render_layer(tmp)
-            # "Over" alpha compositing
-            src_rgb = tmp[..., :3].astype(np.float32)
-            src_a = tmp[..., 3:4].astype(np.float32) / 255
-            dst_rgb = arr[..., :3].astype(np.float32)
-            dst_a = arr[..., 3:4].astype(np.float32) / 255
-            out_a = src_a + dst_a * (1 - src_a)
-            out_rgb = (src_rgb * src_a + dst_rgb * dst_a * (1 - src_a)) / np.clip(out_a, 1e-8, 1)
-            arr[..., :3] = out_rgb.astype(np.uint8)
-            arr[..., 3] = (out_a * 255).astype(np.uint8)[..., 0]
-        return arr
+        self._buffers()
+        versions = [l.version for l in self.layers]
+        footprints = [l.footprint(self.width, self.height) for l in self.layers]
+        ids = [id(l) for l in self.layers]
+        state = self._state
+        if state is None or state["ids"] != ids:
+            # Nothing cached yet: every layer is in the dynamic group
+            group = (0, len(self.layers))
+            fresh = True
+            self._rebuild(*group)
+        else:
+            group, fresh = state["group"], state["fresh"]
+            dirty = [i for i, (a, b) in enumerate(zip(state["versions"], versions)) if a != b]
+            if not dirty:
+                self.last_tiles_recomputed = 0
+            elif fresh or not (group[0] <= dirty[0] and dirty[-1] < group[1]):
+                # Narrow the dynamic group to the dirty layers (or widen it to
+                # include newly dirty ones) and re-cache the static groups
+                if fresh:
+                    group = (dirty[0], dirty[-1] + 1)
+                else:
+                    group = (min(group[0], dirty[0]), max(group[1], dirty[-1] + 1))
+                fresh = False
+                self._rebuild(*group)
+            else:
+                boxes = [state["footprints"][i] for i in dirty] + [footprints[i] for i in dirty]
+                regions, self.last_tiles_recomputed = self._dirty_regions(boxes)
+                for region in regions:
+                    self._redraw(*group, region)
+        self._state = {"ids": ids, "versions": versions, "footprints": footprints, "group": group, "fresh": fresh}
+        return _unpremultiply(self._frame)
 
 def Rotate(theta, cx=0.5, cy=0.5):
     # Rotate theta radians about (cx, cy)
@@ -96,22 +407,23 @@ def Rotate(theta, cx=0.5, cy=0.5):
     T2 = np.array([[1, 0, cx],
                    [0, 1, cy],
                    [0, 0, 1]], dtype=float)
-    return T1 @ R @ T2
-
-img_layer = ImageLayer(img=Image.open("./src/img/google.png"))
-img_layer.set_transform(Rotate(np.pi / 4, cx=0.5, cy=0.5))
-bg_layer = BackgroundLayer(color=(255, 255, 255, 255))
-comp = Compositor(
-    80,
-    24,
-    [
-        bg_layer,
-        img_layer,
-    ]
-)
-
-result = comp.render()
-result_img = Image.fromarray(result, 'RGBA')
-result_img = resize_image(result_img, 24)
-print("\n".join(img_to_ansi(result_img)))
+    return T2 @ R @ T1
+
+if __name__ == "__main__":
+    img_layer = ImageLayer(img=Image.open("./src/img/google.png"))
+    img_layer.set_transform(Rotate(np.pi / 4, cx=0.5, cy=0.5))
+    bg_layer = BackgroundLayer(color=(255, 255, 255, 255))
+    comp = Compositor(
+        80,
+        24,
+        [
+            bg_layer,
+            img_layer,
+        ]
+    )
+
+    result = comp.render()
+    result_img = Image.fromarray(result, 'RGBA')
+    result_img = resize_image(result_img, 24)
+    print("\n".join(img_to_ansi(result_img)))
 
@@ -0,0 +1,80 @@
+import io
+import sys
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .instrument import count, stage
+
+# Coalesce encoded bands into writes of at least this many bytes
+CHUNK_SIZE = 1 << 16
+
+# Per-context replacements for stdout, stderr and input files, so that a
+# daemon can run commands for several clients at once
+_stdout = ContextVar("ansify_stdout", default=None)
+_stderr = ContextVar("ansify_stderr", default=None)
+_inputs = ContextVar("ansify_inputs", default=None)
+
+@contextmanager
+def redirect(out, err, inputs=None):
+    """
+    Sends command output (bytes) to out and messages (text) to err, and
+    serves open_input(name) from the inputs mapping of name -> bytes.
+    """
+    tokens = (_stdout.set(out), _stderr.set(err), _inputs.set(inputs))
+    try:
+        yield
+    finally:
+        for var, token in zip((_stdout, _stderr, _inputs), tokens):
+            var.reset(token)
+
+def stdout_buffer():
+    """Binary stream for command output."""
+    out = _stdout.get()
+    if out is None:
+        sys.stdout.flush()
+        out = sys.stdout.buffer
+    return out
+
+def stderr():
+    """Text stream for diagnostics."""
+    err = _stderr.get()
+    return err if err is not None else sys.stderr
+
+def open_input(name, text=False):
+    """Opens an input file, or its redirected contents."""
+    data = (_inputs.get() or {}).get(name)
+    if data is None:
+        return open(name, encoding="utf-8", errors="replace") if text else open(name, "rb")
+    if text:
+        return io.StringIO(data.decode("utf-8", errors="replace"))
+    return io.BytesIO(data)
+
+def write_chunks(chunks, out=None, chunk_size=CHUNK_SIZE) -> int:
+    """
+    Writes an iterable of bytes to out (default: sys.stdout.buffer),
+    coalescing small pieces into chunk_size writes. The first piece is
+    written and flushed right away so the terminal starts drawing early.
+    Returns the number of bytes written.
+    """
+    if out is None:
+        out = stdout_buffer()
+    pending = bytearray()
+    written = 0
+    first = True
+    for chunk in chunks:
+        pending += chunk
+        if first or len(pending) >= chunk_size:
+            with stage("write"):
+                out.write(pending)
+                out.flush()
+            written += len(pending)
+            pending.clear()
+            first = False
+    with stage("write"):
+        if pending:
+            out.write(pending)
+            written += len(pending)
+        out.flush()
+    count("bytes_written", written)
+    return written
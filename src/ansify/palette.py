@@ -0,0 +1,101 @@
+from functools import lru_cache
+
+import numpy as np
+
+# xterm's default 16-color palette (SGR 30-37 / 90-97)
+ANSI16_RGB = (
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+    (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+)
+
+# Bits per channel kept when indexing the 16-color table
+ANSI16_LUT_BITS = 5
+
+# Luminance threshold for monochrome output (0..255)
+MONO_THRESHOLD = 128
+
+@lru_cache(maxsize=None)
+def ansi256_luts() -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per-channel tables for the xterm 256-color approximation.
+    Returns (cube, gray): cube[v] is the 0..5 cube coordinate of channel
+    value v, gray[v] is the palette index for the gray pixel (v, v, v).
+    """
+    v = np.arange(256)
+    cube = np.round(v / 255 * 5).astype(np.int32)
+    gray = np.round((v - 8) / 247 * 24).astype(np.int32) + 232
+    gray = np.where(v < 8, 16, np.where(v > 248, 231, gray)).astype(np.int32)
+    return cube, gray
+
+@lru_cache(maxsize=None)
+def ansi256_rgb() -> np.ndarray:
+    """(256, 3) uint8 RGB of xterm's default 256-color palette."""
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:16] = ANSI16_RGB
+    levels = np.array([0, 95, 135, 175, 215, 255], dtype=np.uint8)
+    cube = np.arange(216)
+    palette[16:232] = np.stack([levels[cube // 36], levels[cube // 6 % 6], levels[cube % 6]], axis=-1)
+    palette[232:] = (8 + 10 * np.arange(24))[:, None]
+    return palette
+
+@lru_cache(maxsize=None)
+def ansi16_lut() -> np.ndarray:
+    """Nearest 16-color index for every color at ANSI16_LUT_BITS per channel."""
+    n = 1 << ANSI16_LUT_BITS
+    shift = 8 - ANSI16_LUT_BITS
+    centers = (np.arange(n) << shift) + (1 << shift >> 1)
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1)
+    palette = np.array(ANSI16_RGB, dtype=np.int32)
+    dist = ((grid[..., None, :] - palette) ** 2).sum(axis=-1)
+    return dist.argmin(axis=-1).astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def mono_luts() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-channel Rec. 601 luma tables, scaled by 1000."""
+    v = np.arange(256, dtype=np.int32)
+    return v * 299, v * 587, v * 114
+
+def rgb_to_ansi256_array(rgb: np.ndarray) -> np.ndarray:
+    """Maps (..., 3) uint8 pixels to xterm 256-color indices."""
+    cube, gray = ansi256_luts()
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    idx = 16 + 36 * cube[r] + 6 * cube[g] + cube[b]
+    return np.where((r == g) & (g == b), gray[r], idx)
+
+def rgb_to_ansi16_array(rgb: np.ndarray) -> np.ndarray:
+    """Maps (..., 3) uint8 pixels to the nearest of the 16 ANSI colors."""
+    shift = 8 - ANSI16_LUT_BITS
+    lut = ansi16_lut()
+    return lut[rgb[..., 0] >> shift, rgb[..., 1] >> shift, rgb[..., 2] >> shift].astype(np.int32)
+
+def rgb_to_mono_array(rgb: np.ndarray) -> np.ndarray:
+    """Maps (..., 3) uint8 pixels to 1 (lit) or 0 (dark)."""
+    r_lut, g_lut, b_lut = mono_luts()
+    luma = r_lut[rgb[..., 0]] + g_lut[rgb[..., 1]] + b_lut[rgb[..., 2]]
+    return (luma >= MONO_THRESHOLD * 1000).astype(np.int32)
+
+def rgb_to_ansi256(r: int, g: int, b: int) -> int:
+    """Standard xterm 256-color approximation for a single color."""
+    cube, gray = ansi256_luts()
+    if r == g == b:
+        return int(gray[r])
+    return int(16 + 36 * cube[r] + 6 * cube[g] + cube[b])
+
+def quantize(pixels: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Maps (..., 3) uint8 pixels to int32 color codes for a color depth:
+    24 -> packed 0xRRGGBB, 8 -> xterm 256 index, 4 -> ANSI 16 index,
+    1 -> 0/1 lit flag.
+    """
+    if depth == 24:
+        p = pixels.astype(np.int32)
+        return (p[..., 0] << 16) | (p[..., 1] << 8) | p[..., 2]
+    if depth == 8:
+        return rgb_to_ansi256_array(pixels)
+    if depth == 4:
+        return rgb_to_ansi16_array(pixels)
+    if depth == 1:
+        return rgb_to_mono_array(pixels)
+    raise ValueError(f"Unsupported color depth: {depth}. Use 1, 4, 8 or 24 bits.")
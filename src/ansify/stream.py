@@ -0,0 +1,158 @@
+import time
+
+import numpy as np
+
+from .anim import HIDE_CURSOR, SHOW_CURSOR, AnimationStats
+from .encode import encode_damage, encode_halfblock
+from .img import target_size
+from .instrument import count, stage
+from .output import stdout_buffer
+from .palette import quantize
+
+# Channels per pixel of each raw frame format
+FRAME_FORMATS = {"rgb24": 3, "rgba": 4}
+
+# Source pixels sampled per output pixel along each axis when shrinking
+RESIZE_SAMPLES = 4
+
+class FrameReader:
+    """
+    Reads fixed-size raw frames from a binary stream into one reusable
+    buffer. frame is a NumPy view of that buffer, so every read refills it
+    in place and no per-frame copies or allocations happen.
+    """
+    def __init__(self, source, width, height, channels):
+        self.source = source
+        self.buffer = bytearray(width * height * channels)
+        self.view = memoryview(self.buffer)
+        self.frame = np.frombuffer(self.buffer, dtype=np.uint8).reshape(height, width, channels)
+
+    def read(self) -> bool:
+        """Reads the next frame into frame; False at end of stream."""
+        filled = 0
+        size = len(self.buffer)
+        while filled < size:
+            n = self.source.readinto(self.view[filled:])
+            if not n:
+                return False
+            filled += n
+        return True
+
+class FrameResizer:
+    """
+    Shrinks (H, W, C) frames to a fixed size by averaging a grid of up to
+    RESIZE_SAMPLES x RESIZE_SAMPLES source pixels spread over each output
+    pixel's area. The sample positions are computed once, so each frame
+    costs one gather of a few samples per output pixel, whatever the
+    source resolution.
+    """
+    def __init__(self, src_size, dst_size):
+        (sw, sh), (self.width, self.height) = src_size, dst_size
+        self.ys, self.ny = self._samples(sh, self.height)
+        self.xs, self.nx = self._samples(sw, self.width)
+        self.identity = (sw, sh) == (self.width, self.height)
+
+    @staticmethod
+    def _samples(src, dst):
+        n = max(1, min(RESIZE_SAMPLES, src // dst))
+        offsets = (np.arange(n) + 0.5) / n
+        pos = ((np.arange(dst)[:, None] + offsets) * src / dst).astype(np.intp)
+        return np.minimum(pos, src - 1).ravel(), n
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        if self.identity:
+            return frame
+        samples = frame[self.ys][:, self.xs]  # Whole rows first: cheaper
+        if self.ny == self.nx == 1:
+            return samples
+        c = frame.shape[2]
+        # At most 16 samples of 255 each, so uint16 sums cannot overflow
+        samples = samples.astype(np.uint16).reshape(self.height, self.ny, self.width, self.nx, c)
+        return (samples.sum(axis=3).sum(axis=1) // (self.ny * self.nx)).astype(np.uint8)
+
+def frame_codes(pixels: np.ndarray, depth: int, bg_color=(0, 0, 0), brightness=1.0) -> np.ndarray:
+    """Color codes of (H, W, 3|4) uint8 pixels, blended over bg_color if RGBA."""
+    if pixels.shape[2] == 4:
+        rgb = pixels[..., :3].astype(np.int32)
+        a = pixels[..., 3:4].astype(np.int32)
+        pixels = (rgb * a + np.asarray(bg_color[:3], dtype=np.int32) * (255 - a)) // 255
+        if brightness == 1.0:
+            pixels = pixels.astype(np.uint8)
+    if brightness != 1.0:
+        pixels = np.clip(np.trunc(pixels * brightness), 0, 255).astype(np.uint8)
+    return quantize(pixels, depth)
+
+class StreamPlayer:
+    """
+    Plays raw frames from a FrameReader in place at a target frame rate.
+    Frames are shrunk to at most max_height half-block pixels, encoded,
+    and after the first only changed cells are redrawn. When output
+    backpressure or slow encoding put playback behind schedule, frames
+    that are already stale when read are skipped without being resized
+    or encoded. A read that waits longer than a frame resyncs the
+    schedule, so a source slower than fps is shown as it arrives; fps 0
+    never drops or waits.
+    """
+    def __init__(self, reader, max_height, depth, fps=30.0, bg_color=(0, 0, 0), brightness=1.0, out=None, clock=time.monotonic, sleep=time.sleep):
+        h, w = reader.frame.shape[:2]
+        tw, th = target_size((w, h), max_height)
+        self.reader = reader
+        self.resize = FrameResizer((w, h), (tw, th + th % 2))
+        self.depth = depth
+        self.frame_time = 1 / fps if fps else 0.0
+        self.bg_color = bg_color
+        self.brightness = brightness
+        self.out = out
+        self.clock = clock
+        self.sleep = sleep
+
+    def play(self, stats=None) -> AnimationStats:
+        """Plays until the stream ends; returns the AnimationStats for the run."""
+        out = self.out or stdout_buffer()
+        if stats is None:
+            stats = AnimationStats()
+        prev = None
+        start = due = self.clock()
+        out.write(HIDE_CURSOR.encode())
+        try:
+            while True:
+                read_start = self.clock()
+                with stage("read"):
+                    if not self.reader.read():
+                        break
+                now = self.clock()
+                due += self.frame_time
+                if now - read_start > self.frame_time:
+                    due = now  # Waited on the source, so it sets the pace
+                if prev is not None and now > due:
+                    stats.frames_dropped += 1
+                    count("frames_dropped")
+                    continue
+                with stage("resize"):
+                    pixels = self.resize(self.reader.frame)
+                with stage("encode"):
+                    prev, data = self._encode(pixels, prev)
+                with stage("write"):
+                    out.write(data)
+                    out.flush()
+                stats.frames_shown += 1
+                stats.bytes_out += len(data)
+                count("frames_shown")
+                delay = due - self.clock()
+                if delay > 0:
+                    self.sleep(delay)
+        finally:
+            out.write(SHOW_CURSOR.encode())
+            out.flush()
+            stats.elapsed = self.clock() - start
+        return stats
+
+    def _encode(self, pixels, prev):
+        depth = self.depth
+        codes = frame_codes(pixels, depth, self.bg_color, self.brightness)
+        top, bottom = cells = codes[0::2], codes[1::2]
+        if prev is None:
+            data = "".join(line + "\n" for line in encode_halfblock(top, bottom, depth, optimize=True))
+        else:
+            data = encode_damage(prev[0], prev[1], top, bottom, depth)
+        return cells, data.encode("utf-8")
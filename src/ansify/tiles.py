@@ -0,0 +1,205 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from PIL import Image
+
+from .fontindex import cache_dir
+from .instrument import stage
+
+# Bump when the on-disk tile layout changes incompatibly
+TILES_FORMAT = 2
+TILE_SIZE = 256
+
+class TilePyramid:
+    """
+    A multi-resolution image pyramid stored as memory-mapped .npy files,
+    one per level. Level 0 is the source; each level above halves it.
+    A level is a (rows, cols, tile, tile, 4) RGBA array, so every tile is
+    contiguous on disk and reading a region only pages in the tiles it
+    overlaps. Edge tiles are padded with transparent pixels.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, "pyramid.json")) as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.tile = meta["tile"]
+        self.sizes = [tuple(size) for size in meta["sizes"]]
+        self.levels = [
+            np.load(os.path.join(directory, f"level{i}.npy"), mmap_mode="r")
+            for i in range(len(self.sizes))
+        ]
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.sizes[0]
+
+    def region(self, level: int, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """
+        The (h, w, 4) RGBA pixels of level with top left corner (x, y),
+        transparent outside the image. Only overlapping tiles are read.
+        """
+        t = self.tile
+        data = self.levels[level]
+        rows, cols = data.shape[:2]
+        out = np.zeros((h, w, 4), dtype=np.uint8)
+        for ty in range(max(0, y // t), min(rows, -(-(y + h) // t))):
+            for tx in range(max(0, x // t), min(cols, -(-(x + w) // t))):
+                x0, y0 = max(x, tx * t), max(y, ty * t)
+                x1, y1 = min(x + w, (tx + 1) * t), min(y + h, (ty + 1) * t)
+                out[y0 - y:y1 - y, x0 - x:x1 - x] = data[ty, tx, y0 - ty * t:y1 - ty * t, x0 - tx * t:x1 - tx * t]
+        return out
+
+    def view(self, cx: float, cy: float, scale: float, w: int, h: int) -> Image.Image:
+        """
+        A w x h RGBA image centered on level 0 pixel (cx, cy), showing
+        scale source pixels per output pixel. Reads from the level whose
+        resolution is just above the requested one, so the work is bounded
+        by the output size whatever the zoom.
+        """
+        level = min(len(self.levels) - 1, max(0, int(math.floor(math.log2(max(scale, 1.0))))))
+        factor = 2 ** level
+        step = scale / factor
+        x0 = cx / factor - w * step / 2
+        y0 = cy / factor - h * step / 2
+        ix, iy = math.floor(x0), math.floor(y0)
+        iw = math.ceil(x0 + w * step) - ix
+        ih = math.ceil(y0 + h * step) - iy
+        with stage("tiles"):
+            pixels = self.region(level, ix, iy, max(1, iw), max(1, ih))
+        box = (x0 - ix, y0 - iy, x0 - ix + w * step, y0 - iy + h * step)
+        # Show individual source pixels when zoomed in past 1:1
+        resample = Image.NEAREST if scale < 1 else Image.BILINEAR
+        with stage("resize"):
+            return Image.fromarray(pixels, "RGBA").resize((w, h), resample, box=box)
+
+def _downsample(strip: np.ndarray) -> np.ndarray:
+    """
+    Halves an (H, W, 4) RGBA array with even H and W by 2x2 box filtering.
+    Colors are weighted by alpha, so transparent pixels do not darken
+    their neighbours.
+    """
+    h, w, c = strip.shape
+    alpha = strip[..., 3:4].astype(np.uint32)
+    rgb = _sum_blocks(strip[..., :3] * alpha)
+    weight = _sum_blocks(alpha)
+    out = np.empty((h // 2, w // 2, c), dtype=np.uint8)
+    out[..., :3] = (rgb + weight // 2) // np.maximum(weight, 1)
+    out[..., 3:] = (weight + 2) >> 2
+    return out
+
+def _sum_blocks(a: np.ndarray) -> np.ndarray:
+    """Sums of each 2x2 block of a, which has even height and width."""
+    a = a[0::2] + a[1::2]
+    return a[:, 0::2] + a[:, 1::2]
+
+def _write_level(directory, index, size, strips, tile):
+    """Writes level index from an iterator of (tile, W', 4) row strips."""
+    w, h = size
+    rows, cols = -(-h // tile), -(-w // tile)
+    path = os.path.join(directory, f"level{index}.npy")
+    data = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(rows, cols, tile, tile, 4))
+    for ty, strip in enumerate(strips):
+        padded = np.zeros((tile, cols * tile, 4), dtype=np.uint8)
+        padded[:strip.shape[0], :min(strip.shape[1], cols * tile)] = strip[:, :cols * tile]
+        data[ty] = padded.reshape(tile, cols, tile, 4).swapaxes(0, 1)
+    data.flush()
+    return data
+
+def _source_strips(img, tile):
+    w, h = img.size
+    for y in range(0, h, tile):
+        yield np.asarray(img.crop((0, y, w, min(h, y + tile))).convert("RGBA"))
+
+def _half_strips(data, size, tile):
+    """
+    Row strips of the level above data, an image of size, read two tile
+    rows at a time. An odd last row or column is repeated rather than
+    averaged with the transparent padding beyond it.
+    """
+    w, h = size
+    rows, cols = data.shape[:2]
+    for ty in range(0, rows, 2):
+        pair = np.zeros((2 * tile, cols * tile, 4), dtype=np.uint8)
+        for i in range(min(2, rows - ty)):
+            pair[i * tile:(i + 1) * tile, :cols * tile] = data[ty + i].swapaxes(0, 1).reshape(tile, cols * tile, 4)
+        if w % 2:
+            pair[:, w] = pair[:, w - 1]
+        last = h - ty * tile  # Rows of the image in pair
+        if h % 2 and 0 < last < 2 * tile:
+            pair[last] = pair[last - 1]
+        yield _downsample(pair)
+
+def build_pyramid(path, directory, tile=TILE_SIZE) -> TilePyramid:
+    """
+    Decodes the image at path once and writes its pyramid to directory.
+    Levels are built a tile row at a time from the one below, so apart
+    from decoding the source, memory stays at a few tile rows.
+    """
+    os.makedirs(os.path.dirname(directory) or ".", exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(directory) or ".", prefix=".tmp-")
+    try:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None  # Huge scans are the point here
+        try:
+            with Image.open(path) as img:
+                with stage("decode"):
+                    img.load()
+                sizes = [img.size]
+                with stage("level"):
+                    data = _write_level(tmp, 0, img.size, _source_strips(img, tile), tile)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        while max(sizes[-1]) > tile:
+            w, h = sizes[-1]
+            sizes.append((-(-w // 2), -(-h // 2)))
+            with stage("level"):
+                data = _write_level(tmp, len(sizes) - 1, sizes[-1], _half_strips(data, (w, h), tile), tile)
+        with open(os.path.join(tmp, "pyramid.json"), "w") as f:
+            json.dump({"format": TILES_FORMAT, "tile": tile, "sizes": sizes, "source": os.path.realpath(path)}, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp, directory)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return TilePyramid(directory)
+
+def pyramid_dir(path) -> str:
+    """Cache directory for the pyramid of the image file at path."""
+    st = os.stat(path)
+    key = f"{TILES_FORMAT}:{TILE_SIZE}:{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return os.path.join(cache_dir(), "tiles", hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+def load_pyramid(path, directory=None) -> TilePyramid:
+    """
+    The pyramid of the image file at path, built on first use and cached
+    until the file changes.
+    """
+    if directory is None:
+        directory = pyramid_dir(path)
+        if not os.path.exists(os.path.join(directory, "pyramid.json")):
+            _prune(os.path.dirname(directory), os.path.realpath(path))
+    if os.path.exists(os.path.join(directory, "pyramid.json")):
+        return TilePyramid(directory)
+    return build_pyramid(path, directory)
+
+def _prune(root, source):
+    """Removes cached pyramids of older versions of source."""
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            with open(os.path.join(root, entry, "pyramid.json")) as f:
+                stale = json.load(f).get("source") == source
+        except (OSError, ValueError):
+            continue
+        if stale:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
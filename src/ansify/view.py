@@ -0,0 +1,150 @@
+import math
+import os
+import select
+import shutil
+import sys
+
+from .anim import HIDE_CURSOR, SHOW_CURSOR
+from .encode import encode_damage, encode_halfblock, image_to_cells
+from .instrument import stage
+from .output import stdout_buffer
+
+ALT_SCREEN = "\x1b[?1049h\x1b[H\x1b[2J"
+MAIN_SCREEN = "\x1b[?1049l"
+
+# Zoom changes by this factor per key press; pans move this much of the view
+ZOOM_STEP = math.sqrt(2)
+PAN_FRACTION = 0.25
+# Closest zoom: one source pixel per this many output pixels
+MAX_MAGNIFY = 16
+
+KEYS = {
+    "\x1b[A": "up", "\x1b[B": "down", "\x1b[C": "right", "\x1b[D": "left",
+    "k": "up", "j": "down", "l": "right", "h": "left",
+    "w": "up", "s": "down", "d": "right", "a": "left",
+    "+": "in", "=": "in", "-": "out", "_": "out",
+    "0": "fit", "q": "quit", "\x03": "quit",
+}
+
+def parse_keys(data: str) -> list[str]:
+    """Actions for the keys in data; unknown keys and sequences are skipped."""
+    actions = []
+    i = 0
+    while i < len(data):
+        if data.startswith("\x1b[", i) and i + 2 < len(data):
+            key = data[i:i + 3]
+        else:
+            key = data[i]
+        if key in KEYS:
+            actions.append(KEYS[key])
+        i += len(key)
+    return actions
+
+class Viewport:
+    """
+    Pan and zoom state over a TilePyramid: the level 0 pixel at the center
+    of the view and the number of source pixels per output pixel.
+    """
+    def __init__(self, pyramid):
+        self.pyramid = pyramid
+        w, h = pyramid.size
+        self.cx = w / 2
+        self.cy = h / 2
+        self.scale = None
+
+    def fit_scale(self, w, h) -> float:
+        pw, ph = self.pyramid.size
+        return max(pw / w, ph / h, 1 / MAX_MAGNIFY)
+
+    def fit(self, w, h):
+        pw, ph = self.pyramid.size
+        self.cx, self.cy = pw / 2, ph / 2
+        self.scale = self.fit_scale(w, h)
+
+    def apply(self, action, w, h):
+        """Pans or zooms a w x h pixel view."""
+        if self.scale is None or action == "fit":
+            self.fit(w, h)
+            return
+        if action == "in":
+            self.scale = max(1 / MAX_MAGNIFY, self.scale / ZOOM_STEP)
+        elif action == "out":
+            self.scale = min(self.fit_scale(w, h), self.scale * ZOOM_STEP)
+        elif action in ("left", "right"):
+            self.cx += (1 if action == "right" else -1) * PAN_FRACTION * w * self.scale
+        elif action in ("up", "down"):
+            self.cy += (1 if action == "down" else -1) * PAN_FRACTION * h * self.scale
+        pw, ph = self.pyramid.size
+        self.cx = min(max(self.cx, 0), pw)
+        self.cy = min(max(self.cy, 0), ph)
+
+    def render(self, w, h):
+        if self.scale is None:
+            self.fit(w, h)
+        return self.pyramid.view(self.cx, self.cy, self.scale, w, h)
+
+class Viewer:
+    """
+    Interactive pan/zoom viewer for a TilePyramid. Each frame renders
+    only the visible viewport through the half-block encoder and redraws
+    just the cells that changed, so panning and zooming cost the same for
+    any source size. The last terminal line shows the zoom and position.
+    """
+    def __init__(self, pyramid, bg_color=(0, 0, 0), brightness=1.0, depth=24, out=None):
+        self.viewport = Viewport(pyramid)
+        self.bg_color = bg_color
+        self.brightness = brightness
+        self.depth = depth
+        self.out = out
+        self.prev = None
+
+    def frame(self, cols, rows) -> bytes:
+        """The bytes that bring a cols x rows terminal up to date."""
+        rows = max(1, rows - 1)  # Status line
+        img = self.viewport.render(cols, rows * 2)
+        with stage("encode"):
+            top, bottom = cells = image_to_cells(img, bg_color=self.bg_color, brightness=self.brightness, depth=self.depth)
+            if self.prev is None or self.prev[0].shape != top.shape:
+                lines = encode_halfblock(top, bottom, self.depth, optimize=True)
+                data = "\x1b[H\x1b[2J" + "".join(line + "\n" for line in lines)
+            else:
+                data = encode_damage(self.prev[0], self.prev[1], top, bottom, self.depth)
+        self.prev = cells
+        return (data + "\x1b[2K" + self.status()[:cols] + "\r").encode("utf-8")
+
+    def status(self) -> str:
+        view = self.viewport
+        w, h = view.pyramid.size
+        return f" {w}x{h}  zoom {100 / view.scale:.1f}%  at {view.cx:.0f},{view.cy:.0f}  arrows/hjkl pan, +/- zoom, 0 fit, q quit"
+
+    def run(self, fd=None):
+        """Runs the viewer on the terminal until q or Ctrl-C."""
+        import termios
+        import tty
+        if fd is None:
+            fd = sys.stdin.fileno()
+        out = self.out or stdout_buffer()
+        saved = termios.tcgetattr(fd)
+        size = None
+        tty.setcbreak(fd)
+        out.write((ALT_SCREEN + HIDE_CURSOR).encode())
+        try:
+            actions = []
+            while "quit" not in actions:
+                cols, rows = shutil.get_terminal_size()
+                if (cols, rows) != size:
+                    size = (cols, rows)
+                    self.prev = None
+                for action in actions:
+                    self.viewport.apply(action, cols, (rows - 1) * 2)
+                if actions or self.prev is None:
+                    out.write(self.frame(cols, rows))
+                    out.flush()
+                actions = []
+                # Wake up now and then to notice terminal resizes
+                if select.select([fd], [], [], 0.25)[0]:
+                    actions = parse_keys(os.read(fd, 1024).decode("utf-8", errors="replace"))
+        finally:
+            out.write((SHOW_CURSOR + MAIN_SCREEN).encode())
+            out.flush()
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)